@@ -0,0 +1,182 @@
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from flask import current_app
+
+from . import client
+from .events import Event, get
+from .observables import Observable, complete, single_query
+
+Search = Callable[[bool, int], List[Event]]
+
+
+def prefetch(observables: List[Tuple[Observable, str]], limit: int,
+             creds: dict, submit: Callable[..., Future]) -> List[Search]:
+    """Schedules the searches for events of the observables.
+
+    Observables of the same type are searched in batches where possible,
+    the others one by one. Returns a search function per observable
+    suitable for `Observable.observe`, in the same order.
+    """
+
+    searches = [None] * len(observables)
+    groups = defaultdict(list)
+
+    for index, (observable, value) in enumerate(observables):
+        if observable.paths():
+            groups[observable.type()].append(index)
+        else:
+            searches[index] = observable.prefetch(value, limit, creds, submit)
+
+    for indices in groups.values():
+        observable = observables[indices[0]][0]
+        values = [observables[index][1] for index in indices]
+        batched = {}
+
+        for chunk in chunks(observable, values):
+            if len(chunk) == 1:
+                batched[chunk[0]] = observable.prefetch(chunk[0], limit,
+                                                        creds, submit)
+            else:
+                batched.update(prefetch_batch(observable, chunk, limit,
+                                              creds, submit))
+
+        for index, value in zip(indices, values):
+            searches[index] = batched[value]
+
+    return searches
+
+
+def chunks(observable: Observable, values: List[str]) -> List[List[str]]:
+    """Splits distinct values into batches fitting the filter budget."""
+
+    size = current_app.config['QUALYS_BATCH_SIZE']
+    length = current_app.config['QUALYS_BATCH_FILTER_LENGTH']
+
+    result = []
+    chunk, chunk_length = [], 0
+
+    for value in dict.fromkeys(values):
+        value_length = len(quote(f'({observable.filter(value)}) or '))
+
+        if chunk and (len(chunk) == size
+                      or chunk_length + value_length > length):
+            result.append(chunk)
+            chunk, chunk_length = [], 0
+
+        chunk.append(value)
+        chunk_length += value_length
+
+    if chunk:
+        result.append(chunk)
+
+    return result
+
+
+def prefetch_batch(observable: Observable, values: List[str], limit: int,
+                   creds: dict, submit: Callable[..., Future]) \
+        -> Dict[str, Search]:
+    """Schedules batched searches like `Observable.prefetch` does.
+
+    The active events of the observables the search for events of any
+    state is not enough for are searched in a batch of their own.
+    """
+
+    single = single_query(current_app.config['API_URL'])
+
+    def fetch(active: bool) -> Optional[Dict[bool, Dict[str, List[Event]]]]:
+        found = search(observable, values, active, limit, creds)
+        if found is None:
+            return None
+
+        found = {active: found}
+        if single:
+            rest = [value for value in values
+                    if not complete(found[active][value], limit)]
+            if rest:
+                found[True] = search(observable, rest, True, limit,
+                                     creds) or {}
+
+        return found
+
+    if single:
+        futures = dict.fromkeys([True, False], submit(fetch, False))
+    else:
+        futures = {active: submit(fetch, active) for active in [True, False]}
+
+    def searcher(value: str) -> Search:
+        def search_(active: bool, amount: int) -> List[Event]:
+            if amount <= 0:
+                return []
+
+            found = futures[active].result()
+            if found is None or value not in found.get(active, {}):
+                return client.events(active, amount, creds,
+                                     quote(observable.filter(value)))
+
+            return found[active][value][:amount]
+
+        return search_
+
+    return {value: searcher(value) for value in values}
+
+
+def search(observable: Observable, values: List[str], active: bool,
+           limit: int, creds: dict) -> Optional[Dict[str, List[Any]]]:
+    """Searches for events of several observables with a single filter.
+
+    Pages through the combined result until every observable has got
+    `limit` events or there are no more events, and routes each event
+    to the observables found in it. As long as Qualys keeps the order of
+    events, each observable gets exactly the events a separate search
+    would have returned. Observables left short after the page budget is
+    spent are searched separately.
+
+    Returns `None` if Qualys rejected the combined filter or the events
+    could not be told apart, so the observables of this batch are searched
+    one by one instead.
+    """
+
+    page_size = current_app.config['QUALYS_PAGE_SIZE']
+    max_pages = current_app.config['QUALYS_BATCH_MAX_PAGES']
+
+    filter_ = quote(' or '.join(f'({observable.filter(value)})'
+                                for value in values))
+
+    # Qualys compares the values case-insensitively.
+    keys = {value: value.casefold() for value in values}
+    found = {key: [] for key in keys.values()}
+
+    for page in range(max_pages):
+        events = client.search(active, page_size, creds, filter_, page)
+        if events is None:
+            return None
+
+        for event in events:
+            matched = found.keys() & {
+                str(value).casefold()
+                for value in (get(event, path) for path in observable.paths())
+                if value is not None
+            }
+
+            if not matched:
+                return None
+
+            for key in matched:
+                if len(found[key]) < limit:
+                    found[key].append(event)
+
+        if len(events) < page_size or all(
+                len(events_) >= limit for events_ in found.values()
+        ):
+            break
+    else:
+        for key in found:
+            if len(found[key]) < limit:
+                value = next(v for v, k in keys.items() if k == key)
+                found[key] = client.events(active, limit, creds,
+                                           quote(observable.filter(value)))
+
+    return {value: found[key] for value, key in keys.items()}
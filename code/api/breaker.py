@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import defaultdict
+from http import HTTPStatus
+from typing import Any, Callable, Dict
+
+from flask import current_app
+from requests import Response
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+
+from api import deadline, sessions
+from api.errors import QualysUnavailableError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Responses telling that Qualys itself is failing rather than the request.
+FAILURES = {
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+}
+
+
+class Breaker:
+    """A circuit breaker of calls to a single API.
+
+    Once `threshold` calls in a row fail, the breaker opens and calls fail
+    fast for `reset` seconds. Then it gets half-open and lets a single probe
+    call through: the breaker closes if the probe succeeds and opens again
+    if it fails.
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def enter(self, reset: float):
+        """Lets a call through or raises `QualysUnavailableError`."""
+
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self.opened_at + reset - time.monotonic()
+                if retry_in > 0:
+                    raise QualysUnavailableError(retry_in)
+
+                self.state = HALF_OPEN
+
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    raise QualysUnavailableError(reset)
+
+                self.probing = True
+
+    def exit(self, failed: bool, threshold: int):
+        """Records the outcome of a call let through by `enter`."""
+
+        with self._lock:
+            probe, self.probing = self.probing, False
+
+            if not failed:
+                self.state, self.failures = CLOSED, 0
+                return
+
+            self.failures += 1
+            if probe or self.failures >= threshold:
+                self.state, self.opened_at = OPEN, time.monotonic()
+
+    def release(self):
+        """Lets another probe through after a call without an outcome."""
+
+        with self._lock:
+            self.probing = False
+
+    def stats(self, reset: float) -> Dict[str, Any]:
+        result = {'state': self.state, 'failures': self.failures}
+        if self.state == OPEN:
+            retry_in = self.opened_at + reset - time.monotonic()
+            result['retry_in'] = round(max(retry_in, 0), 1)
+
+        return result
+
+
+_breakers = defaultdict(Breaker)
+_breakers_lock = threading.Lock()
+
+
+def of(api: str) -> Breaker:
+    with _breakers_lock:
+        return _breakers[api]
+
+
+def call(api: str, send: Callable[[], Response]) -> Response:
+    """Makes a call to the API through its circuit breaker.
+
+    Connection errors, timeouts and 5xx responses count as failures, but
+    timeouts cut short by the deadline of the request do not, since they
+    tell nothing about the API. That includes timeouts of reading the body,
+    see `sessions.read_timed_out`. The breakers are kept per worker process.
+    """
+
+    threshold = current_app.config['QUALYS_BREAKER_THRESHOLD']
+    reset = current_app.config['QUALYS_BREAKER_RESET']
+
+    breaker = of(api)
+    breaker.enter(reset)
+    left = deadline.remaining()
+
+    try:
+        response = send()
+    except Timeout as error:
+        if cut_short(error, left):
+            breaker.release()
+        else:
+            breaker.exit(True, threshold)
+        raise
+    except ConnectionError as error:
+        if sessions.read_timed_out(error) and cut_short(error, left):
+            breaker.release()
+        else:
+            breaker.exit(True, threshold)
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+
+    breaker.exit(response.status_code in FAILURES, threshold)
+    return response
+
+
+def cut_short(error: Exception, left: float = None) -> bool:
+    """Tells whether the timeout was cut to the `left` seconds until the
+    deadline of the request, see `sessions.timeout`."""
+
+    if left is None:
+        return False
+
+    config = current_app.config
+    timeout = (config['HTTP_CONNECT_TIMEOUT']
+               if isinstance(error, ConnectTimeout)
+               else config['HTTP_READ_TIMEOUT'])
+
+    return left <= timeout
+
+
+def stats(api: str) -> Dict[str, Any]:
+    """Returns the state of the breaker of the API in the current worker
+    process."""
+    return of(api).stats(current_app.config['QUALYS_BREAKER_RESET'])
@@ -0,0 +1,171 @@
+import json
+import time
+import threading
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from flask import current_app
+
+from api import metrics
+
+try:
+    import uwsgi
+except ImportError:
+    # Not running under uWSGI, so only the in-process cache is available.
+    uwsgi = None
+
+_backend = None
+_backend_lock = threading.Lock()
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+class MemoryCache:
+    """A thread-safe LRU cache of expiring entries.
+
+    The total weight of the entries is kept within the capacity by evicting
+    the least recently used ones.
+    """
+
+    name = 'memory'
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.weight = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, item: type = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, _, value = entry
+            if expires_at <= time.monotonic():
+                self._pop(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float, weight: int = 1,
+            item: type = None):
+        if weight > self.capacity:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+            self._entries[key] = (time.monotonic() + ttl, weight, value)
+            self.weight += weight
+
+            while self.weight > self.capacity:
+                self._pop(next(iter(self._entries)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), 'weight': self.weight,
+                'capacity': self.capacity}
+
+    def _pop(self, key: str):
+        _, weight, _ = self._entries.pop(key)
+        self.weight -= weight
+
+
+class UWSGICache:
+    """A cache shared by all worker processes through a uWSGI cache.
+
+    The cache itself (its size and LRU purging) is configured
+    with the `cache2` option in `uwsgi.ini`.
+    """
+
+    name = 'uwsgi'
+
+    def __init__(self, cache_name: str):
+        self.cache_name = cache_name
+
+    def get(self, key: str, item: type = None) -> Any:
+        value = uwsgi.cache_get(key, self.cache_name)
+        if value is None:
+            return None
+
+        value = json.loads(value)
+        return list(map(item.from_json, value)) if item else value
+
+    def set(self, key: str, value: Any, ttl: float, weight: int = 1,
+            item: type = None):
+        if item:
+            value = [entry.json() for entry in value]
+
+        # uWSGI treats zero as no expiration at all.
+        expires = max(int(ttl), 1)
+        uwsgi.cache_update(key, json.dumps(value), expires, self.cache_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'cache_name': self.cache_name}
+
+
+def backend():
+    """Returns the cache backend of the worker process."""
+
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = current_app.config
+
+                if config['QUALYS_CACHE_BACKEND'] == 'uwsgi' and uwsgi:
+                    _backend = UWSGICache(config['QUALYS_CACHE_NAME'])
+                else:
+                    _backend = MemoryCache(config['QUALYS_CACHE_MAX_EVENTS'])
+
+    return _backend
+
+
+def cached(key: Hashable, fetch: Callable[[], Optional[list]],
+           item: type = None) -> Optional[list]:
+    """Returns a cached list for the key or the one fetched.
+
+    Everything that tells tenants apart (the API URL and credentials)
+    must be a part of the key. Only lists are cached, weighted by length.
+    Items of the `item` class are shared between processes as the JSON
+    of their `json` method and made again with `from_json`.
+    """
+
+    ttl = current_app.config['QUALYS_CACHE_TTL']
+    if ttl <= 0:
+        return fetch()
+
+    key = sha256(json.dumps(key).encode()).hexdigest()
+
+    value = backend().get(key, item)
+    count('hits' if value is not None else 'misses')
+    if value is not None:
+        return value
+
+    value = fetch()
+    if isinstance(value, list):
+        backend().set(key, value, ttl, max(len(value), 1), item)
+
+    return value
+
+
+def count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+    metrics.inc('relay_cache_requests_total', result=name)
+
+
+def stats() -> Dict[str, Any]:
+    """Returns statistics of the cache for the current worker process."""
+
+    result = dict(_stats)
+    if _backend is not None:
+        result.update(backend=_backend.name, **_backend.stats())
+
+    return result
@@ -1,24 +1,138 @@
-import requests
+import hmac
+import json
+import random
+import time
+import threading
 
-from typing import Dict
+import jwt
+from typing import Any, Dict, List, Optional, Tuple
+from hashlib import sha256
 from http import HTTPStatus
-from flask import g, current_app
-from requests.exceptions import SSLError, ConnectionError, MissingSchema
+from collections import OrderedDict, defaultdict
+from email.utils import parsedate_to_datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from flask import current_app
+from requests import Response
+from requests.exceptions import (
+    SSLError,
+    ConnectionError,
+    MissingSchema,
+    Timeout
+)
 
 from api.errors import (
     CriticalResponseError,
     QualysConnectionError,
-    QualysSSLError
+    QualysSSLError,
+    QualysTimeoutError
 )
-from api.utils import url_join
+from api import breaker, cache, deadline, limiter, metrics, sessions
+from api.events import Event
+from api.utils import iter_json_array, submitter, url_join
 
 agent = ('SecureX Threat Response Integrations '
          '<tr-integrations-support@cisco.com>')
 
+# Timeouts within this many seconds of the request deadline
+# are put down to the deadline rather than to Qualys.
+TIMEOUT_SLACK = 0.5
+
+# Responses worth retrying after a while.
+RETRY_STATUSES = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE}
+
+# Qualys tokens per `(API_URL, user, password digest)` as
+# `(expires_at, token)` pairs, shared by all threads of a worker process,
+# the least recently used first.
+_tokens = OrderedDict()
+_tokens_locks = defaultdict(threading.Lock)
+_tokens_lock = threading.Lock()
 
-def events(active: bool, amount: int, credentials: dict, filter_: str = None):
+
+def events(active: bool, amount: int, credentials: dict, filter_: str = None,
+           page: int = 0, fresh: bool = False):
     """Performs a request to Qualys to search
-    for events with the specified filter."""
+    for events with the specified filter.
+
+    Returns the specified page (counting from zero) of `amount` events.
+    Cached results are reused unless `fresh` ones are requested.
+    """
+    return search(active, amount, credentials, filter_, page, fresh) or []
+
+
+def search(active: bool, amount: int, credentials: dict, filter_: str = None,
+           page: int = 0, fresh: bool = False) \
+        -> Optional[List[Event]]:
+    """Same as `events`, but returns `None` if Qualys rejected the search.
+
+    More than `QUALYS_PAGE_SIZE` events are searched page by page.
+    """
+
+    if not page and amount > current_app.config['QUALYS_PAGE_SIZE']:
+        return paginate(active, amount, credentials, filter_, fresh)
+
+    return search_page(active, amount, credentials, filter_, page, fresh)
+
+
+def paginate(active: bool, amount: int, credentials: dict, filter_: str,
+             fresh: bool) -> Optional[List[Event]]:
+    """Searches for `amount` events in pages of `QUALYS_PAGE_SIZE` events.
+
+    Once the first page turns out full, up to `QUALYS_PAGE_CONCURRENCY`
+    of the following pages are requested at once. The pages are taken
+    in order until `amount` events are found or a page comes out short.
+    Events that moved to the next page while paging are skipped.
+    """
+
+    page_size = current_app.config['QUALYS_PAGE_SIZE']
+    pages = -(-amount // page_size)
+
+    def fetch(page):
+        return search_page(active, page_size, credentials, filter_, page,
+                           fresh)
+
+    first = fetch(0)
+    if first is None:
+        return None
+
+    found = {}
+    concurrency = min(current_app.config['QUALYS_PAGE_CONCURRENCY'], pages - 1)
+    executor = (ThreadPoolExecutor(max_workers=concurrency)
+                if concurrency > 1 and len(first) == page_size else None)
+
+    try:
+        if executor is None:
+            rest = map(fetch, range(1, pages))
+        else:
+            submit = submitter(executor)
+            futures = [submit(fetch, page) for page in range(1, pages)]
+            rest = (future.result() for future in futures)
+
+        for events_ in chain([first], rest):
+            # A page rejected after the first one just ends the search.
+            for event in events_ or []:
+                found.setdefault(event_id(event), event)
+
+            if (events_ is None or len(events_) < page_size
+                    or len(found) >= amount):
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return list(islice(found.values(), amount))
+
+
+def event_id(event: Event) -> Any:
+    """Returns the ID of an event, or the event itself if it has none."""
+    return event.id if event.id is not None else id(event)
+
+
+def search_page(active: bool, amount: int, credentials: dict,
+                filter_: str = None, page: int = 0, fresh: bool = False) \
+        -> Optional[List[Event]]:
+    """Searches for a single page of events like `search` does."""
 
     # Do not make requests if `amount` is non-positive.
     if amount <= 0:
@@ -27,22 +141,71 @@ def events(active: bool, amount: int, credentials: dict, filter_: str = None):
     api = current_app.config['API_URL']
     url = f'{api}/ioc/events?pageSize={amount}'
 
+    if page:
+        url += f'&pageNumber={page}'
     if filter_:
         url += f'&filter={filter_}'
     if active:
         url += '&state=true'
 
-    return get_data(url, credentials)
+    def fetch():
+        return Event.parse(get_data(url, credentials, limit=amount))
 
+    if fresh:
+        return fetch()
 
-def get_data(url, credentials):
-    try:
-        response = requests.get(url, headers=headers(credentials))
+    # The URL holds the API URL, so along with the credentials
+    # it keeps the results of different tenants apart.
+    key = [credentials['user'], digest(credentials['pass']), url]
+    return cache.cached(key, fetch, Event)
+
+
+def get_data(url, credentials, limit: int = None):
+    """Performs a GET request to Qualys and returns the received JSON.
+
+    With `QUALYS_STREAM_PARSING` on, a JSON array is parsed item by item
+    while the response is being read, and the reading stops once `limit`
+    items are parsed.
+    """
+
+    api = current_app.config['API_URL']
+    stream = current_app.config['QUALYS_STREAM_PARSING']
+    retries = current_app.config['QUALYS_RETRIES']
+
+    def send():
+        limiter.acquire(api, credentials['user'])
+
+        token_ = token(credentials)
+        response_ = breaker.call(api, partial(
+            sessions.get, url, 'events', headers=headers(token_),
+            stream=stream
+        ))
 
         # Refresh the token if expired.
-        if response.status_code == HTTPStatus.UNAUTHORIZED:
-            response = requests.get(url, headers=headers(credentials,
-                                                         fresh=True))
+        if response_.status_code == HTTPStatus.UNAUTHORIZED:
+            response_.close()
+            token_ = token(credentials, rejected=token_)
+            response_ = breaker.call(api, partial(
+                sessions.get, url, 'events', headers=headers(token_),
+                stream=stream
+            ))
+
+        return response_
+
+    try:
+        for attempt in range(retries + 1):
+            response = send()
+
+            delay = retry_delay(response, attempt)
+            if delay is None or attempt == retries:
+                break
+
+            response.close()
+            time.sleep(delay)
+
+        if response.ok and stream:
+            with response:
+                return read_json(response, limit)
 
         if response.ok:
             return response.json()
@@ -50,46 +213,205 @@ def get_data(url, credentials):
         if response.status_code in (
                 HTTPStatus.NOT_FOUND, HTTPStatus.BAD_REQUEST
         ):
+            response.close()
             return {}
 
         raise CriticalResponseError(response)
 
     except SSLError as error:
         raise QualysSSLError(error)
-    except (ConnectionError, MissingSchema):
-        raise QualysConnectionError(current_app.config['API_URL'])
+    except (ConnectionError, MissingSchema) as error:
+        if not sessions.read_timed_out(error):
+            raise QualysConnectionError(current_app.config['API_URL'])
+
+        # Reading the body timed out, see `Timeout` below.
+        deadline.check(slack=TIMEOUT_SLACK)
+        raise QualysTimeoutError(current_app.config['API_URL'])
+    except Timeout:
+        # The timeouts are cut when the request deadline is close.
+        deadline.check(slack=TIMEOUT_SLACK)
+        raise QualysTimeoutError(current_app.config['API_URL'])
+
+
+def retry_delay(response: Response, attempt: int) -> Optional[float]:
+    """Returns how long to wait before retrying a throttled or failed call.
+
+    The `Retry-After` header is honoured if present, otherwise the delay
+    grows exponentially with the attempt number, with full jitter. Returns
+    `None` if the call should not be retried, e.g. the delay would last
+    longer than `QUALYS_RETRY_MAX_DELAY` or past the request deadline.
+    """
 
+    if response.status_code not in RETRY_STATUSES:
+        return None
 
-def headers(credentials: dict, fresh: bool = False) -> Dict[str, str]:
+    backoff = current_app.config['QUALYS_RETRY_BACKOFF']
+    max_delay = current_app.config['QUALYS_RETRY_MAX_DELAY']
+
+    delay = retry_after(response.headers.get('Retry-After'))
+    if delay is None:
+        delay = random.uniform(0, backoff * 2 ** attempt)
+    else:
+        # Keep the workers that were told the same time from coming back
+        # all at once.
+        delay += random.uniform(0, backoff)
+
+    left = deadline.remaining()
+    if delay > max_delay or (left is not None and delay >= left):
+        return None
+
+    return delay
+
+
+def retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses a `Retry-After` header given either in seconds or as a date."""
+
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        return float(value)
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def read_json(response: Response, limit: int = None) -> Any:
+    """Incrementally reads JSON from a streamed response.
+
+    Only the first `limit` items of an array are read.
+    """
+
+    chunks = deadline.guard(
+        response.iter_content(current_app.config['QUALYS_STREAM_CHUNK'])
+    )
+    first = next(chunks, b'')
+    chunks = chain([first], chunks)
+
+    if not first.lstrip().startswith(b'['):
+        return json.loads(b''.join(chunks))
+
+    return list(islice(iter_json_array(chunks), limit))
+
+
+def headers(token_: str) -> Dict[str, str]:
     """Returns headers with an authorization token for Qualys."""
     return {
         'Accept': 'application/json',
-        'Authorization': 'Bearer ' + token(credentials, fresh),
+        'Authorization': 'Bearer ' + token_,
         'Content-Type': 'application/json',
         'User-Agent': agent
     }
 
 
-def token(credentials: dict, fresh: bool = False) -> str:
-    """Returns an authorization token for Qualys."""
+def token(credentials: dict, rejected: str = None) -> str:
+    """Returns an authorization token for Qualys.
+
+    The token is reused across requests until it is about to expire or until
+    Qualys rejects it, in which case the rejected token must be passed so
+    that only a single fresh token is fetched even if several threads got
+    the rejection at once.
+    """
+
+    api = current_app.config['API_URL']
+    key = (api, credentials['user'], digest(credentials['pass']))
+    margin = current_app.config['QUALYS_TOKEN_REFRESH_MARGIN']
+
+    def cached():
+        with _tokens_lock:
+            entry = _tokens.get(key)
+            if entry is None:
+                return None
+
+            _tokens.move_to_end(key)
 
-    if fresh or not hasattr(g, 'token'):
-        username = credentials['user']
-        password = credentials['pass']
+        expires_at, token_ = entry
+        if token_ == rejected or expires_at - margin <= time.monotonic():
+            return None
 
-        url = url_join(current_app.config['API_URL'], '/auth')
-        content = 'application/x-www-form-urlencoded'
+        return token_
 
-        response = requests.post(url,
-                                 data=b'username=' + username.encode() + b'&'
-                                      b'password=' + password.encode() + b'&'
-                                      b'token=true',
-                                 headers={'Content-Type': content,
-                                          'User-Agent': agent})
+    token_ = cached()
+    if token_ is not None:
+        return token_
+
+    with _tokens_lock:
+        lock = _tokens_locks[key]
+
+    # Let only one thread at a time fetch a token for the same key.
+    with lock:
+        token_ = cached()
+        if token_ is None:
+            try:
+                expires_at, token_ = fetch_token(api, credentials)
+            except Exception:
+                # Keep failed attempts from piling up locks.
+                with _tokens_lock:
+                    if _tokens_locks.get(key) is lock:
+                        del _tokens_locks[key]
+                raise
+
+            store_token(key, expires_at, token_)
+
+        return token_
+
+
+def store_token(key: tuple, expires_at: float, token_: str):
+    """Caches the token for the key, evicting the tokens of the least
+    recently used keys beyond `QUALYS_TOKEN_CACHE_MAX_KEYS`."""
+
+    max_keys = current_app.config['QUALYS_TOKEN_CACHE_MAX_KEYS']
+
+    with _tokens_lock:
+        _tokens[key] = (expires_at, token_)
+        _tokens.move_to_end(key)
+
+        while len(_tokens) > max_keys:
+            key_, _ = _tokens.popitem(last=False)
+            _tokens_locks.pop(key_, None)
+
+
+def fetch_token(api: str, credentials: dict) -> Tuple[float, str]:
+    """Requests a new authorization token from Qualys.
+
+    Returns the token along with the monotonic time it expires at.
+    """
+
+    username = credentials['user']
+    password = credentials['pass']
+
+    url = url_join(api, '/auth')
+    content = 'application/x-www-form-urlencoded'
+
+    response = breaker.call(api, partial(
+        sessions.post, url, 'auth',
+        data=b'username=' + username.encode() + b'&'
+             b'password=' + password.encode() + b'&'
+             b'token=true',
+        headers={'Content-Type': content, 'User-Agent': agent}
+    ))
+
+    if not response.ok:
+        raise CriticalResponseError(response)
+
+    metrics.inc('relay_token_refreshes_total')
+
+    token_ = response.text
+    ttl = current_app.config['QUALYS_TOKEN_TTL']
+
+    # Qualys tokens are JWTs, so trust their own expiration time if any.
+    try:
+        claims = jwt.decode(token_, options={'verify_signature': False})
+        ttl = min(ttl, float(claims['exp']) - time.time())
+    except (jwt.DecodeError, KeyError, TypeError, ValueError):
+        pass
 
-        if not response.ok:
-            raise CriticalResponseError(response)
+    return time.monotonic() + ttl, token_
 
-        g.token = response.text
 
-    return g.token
+def digest(password: str) -> str:
+    """Returns a keyed digest of a password suitable for cache keys."""
+    secret = current_app.config['SECRET_KEY'].encode()
+    return hmac.new(secret, password.encode(), sha256).hexdigest()
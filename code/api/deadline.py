@@ -0,0 +1,47 @@
+import time
+from contextvars import ContextVar, Token
+from typing import Iterable, Iterator, Optional, TypeVar
+
+from api.errors import DeadlineExceededError
+
+T = TypeVar('T')
+
+# The monotonic time by which the current request has to be served.
+# Tasks submitted with `utils.submitter` inherit it.
+_deadline = ContextVar('deadline', default=None)
+
+
+def start(at: Optional[float]) -> Token:
+    """Sets the monotonic time the outbound calls have to end by.
+
+    Returns a token to `reset` the deadline with.
+    """
+    return _deadline.set(at)
+
+
+def reset(token: Token):
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Returns the seconds left until the deadline if there is one."""
+
+    at = _deadline.get()
+    return at - time.monotonic() if at is not None else None
+
+
+def check(slack: float = 0):
+    """Raises `DeadlineExceededError` if no more than `slack` seconds
+    are left until the deadline."""
+
+    left = remaining()
+    if left is not None and left <= slack:
+        raise DeadlineExceededError()
+
+
+def guard(items: Iterable[T]) -> Iterator[T]:
+    """Yields the items as long as the deadline is not exceeded."""
+
+    for item in items:
+        check()
+        yield item
@@ -1,37 +1,114 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from typing import Dict, List, Tuple
 from urllib.parse import quote
 
 from flask import Blueprint, current_app, g
 
+from . import batches, deadline
+from .errors import DeadlineExceededError
 from .observables import Observable
 from .schema import ObservableSchema
-from .utils import get_json, jsonify_result, jsonify_data, get_credentials
+from .utils import (
+    add_error,
+    get_json,
+    jsonify_result,
+    jsonify_data,
+    get_credentials,
+    stream_result,
+    submitter
+)
 
 api = Blueprint('enrich', __name__)
 
 get_observables = partial(get_json, schema=ObservableSchema(many=True))
 
 
+def supported(observables: List[Dict[str, str]]) \
+        -> List[Tuple[Observable, str, str]]:
+    """Returns distinct supported observables in the requested order.
+
+    Each observable comes along with its handler and canonical value.
+    """
+
+    result = {}
+
+    for pair in observables:
+        type_ = pair['type']
+        value = pair['value']
+
+        observable = Observable.of(type_)
+        if observable is None:
+            continue
+
+        result.setdefault((type_, value),
+                          (observable, value, observable.normalize(value)))
+
+    return list(result.values())
+
+
 @api.route('/observe/observables', methods=['POST'])
 def observe():
     observables = get_observables()
     creds = get_credentials()
     limit = current_app.config['CTR_ENTITIES_LIMIT']
 
+    budget = current_app.config['OBSERVE_DEADLINE']
+    deadline_at = time.monotonic() + budget if budget > 0 else None
+
+    def observed():
+        executor = ThreadPoolExecutor(
+            max_workers=current_app.config['OBSERVE_CONCURRENCY']
+        )
+        token = deadline.start(deadline_at)
+
+        try:
+            # Start searching for all the observables at once,
+            # but collect the results in the original order.
+            requested = supported(observables)
+            distinct = list(dict.fromkeys(
+                (observable, canonical)
+                for observable, _, canonical in requested
+            ))
+
+            searches = dict(zip(distinct, batches.prefetch(
+                distinct, limit, creds, submitter(executor)
+            )))
+
+            # IDs of the objects returned so far, so that objects shared
+            # by several observables are returned just once.
+            seen = set()
+            exceeded = False
+
+            for observable, value, canonical in requested:
+                search = searches[observable, canonical]
+
+                try:
+                    observed_data = observable.observe(value, limit, creds,
+                                                       search, seen)
+                except DeadlineExceededError as error:
+                    # Skip the observable, but still return the others
+                    # whose searches have already been made.
+                    if not exceeded:
+                        add_error(error)
+                    exceeded = True
+                    continue
+
+                yield observed_data
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            deadline.reset(token)
+
+    if current_app.config['OBSERVE_STREAMING']:
+        return stream_result(observed())
+
     g.sightings = []
     g.indicators = []
     g.judgements = []
     g.relationships = []
 
-    for pair in observables:
-        type_ = pair['type']
-        value = pair['value']
-
-        observable = Observable.of(type_)
-        if observable is None:
-            continue
-
-        observed_data = observable.observe(value, limit, creds)
+    for observed_data in observed():
         g.sightings.extend(observed_data["sightings"])
         g.indicators.extend(observed_data["indicators"])
         g.judgements.extend(observed_data["judgements"])
@@ -46,13 +123,8 @@ def refer():
     _ = get_credentials()
     result = []
 
-    for pair in observables:
-        type_ = pair['type']
-        value = pair['value']
-
-        observable = Observable.of(type_)
-        if observable is None:
-            continue
+    for observable, value, canonical in supported(observables):
+        type_ = observable.type()
 
         result.append({
             'id': f'ref-qualys-search-{type_}-{quote(value, safe="")}',
@@ -60,7 +132,8 @@ def refer():
                 f'Search for this {observable.name()}',
             'description':
                 f'Check this {observable.name()} status with Qualys',
-            'url': observable.refer(current_app.config['PLATFORM_URL'], value),
+            'url': observable.refer(current_app.config['PLATFORM_URL'],
+                                    canonical),
             'categories': ['Search', 'Qualys']
         })
 
@@ -1,3 +1,4 @@
+import math
 from http import HTTPStatus
 
 INVALID_ARGUMENT = 'invalid argument'
@@ -9,6 +10,7 @@ UNAUTHORIZED = 'unauthorized'
 NOT_FOUND = 'not found'
 UNAVAILABLE = 'service unavailable'
 CONNECTION_ERROR = 'connection error'
+TIMEOUT = 'timeout'
 
 
 class TRFormattedError(Exception):
@@ -44,6 +46,34 @@ class QualysConnectionError(TRFormattedError):
         )
 
 
+class QualysTimeoutError(TRFormattedError):
+    def __init__(self, url):
+        super().__init__(
+            TIMEOUT,
+            f'Qualys IOC did not respond in time,'
+            f' validate the configured API URL: {url}'
+        )
+
+
+class QualysUnavailableError(TRFormattedError):
+    def __init__(self, retry_in):
+        super().__init__(
+            UNAVAILABLE,
+            f'Qualys IOC is unavailable after repeated failures.'
+            f' Please try again in {math.ceil(retry_in)} seconds.'
+        )
+
+
+class DeadlineExceededError(TRFormattedError):
+    def __init__(self):
+        super().__init__(
+            TIMEOUT,
+            'Qualys IOC did not respond in time,'
+            ' so only a part of the results is returned.',
+            type_='warning'
+        )
+
+
 class AuthorizationError(TRFormattedError):
     def __init__(self, message):
         super().__init__(
@@ -0,0 +1,174 @@
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import current_app
+
+
+@lru_cache(maxsize=None)
+def accessor(path: str) -> Callable[..., Any]:
+    """Compiles a path like '.asset.fullOSName' into a function
+    that returns the value by the path if such exists or default."""
+
+    # Skip the first entry.
+    # It is always empty due to the leading period.
+    keys = tuple(path.split('.')[1:])
+
+    if len(keys) == 1:
+        key, = keys
+
+        def access(event, default=None):
+            return event[key] if key in event else default
+
+    elif len(keys) == 2:
+        first, second = keys
+
+        def access(event, default=None):
+            if first in event:
+                value = event[first]
+                if second in value:
+                    return value[second]
+            return default
+
+    else:
+        def access(event, default=None):
+            result = event
+            for key_ in keys:
+                if key_ in result:
+                    result = result[key_]
+                else:
+                    return default
+            return result
+
+    return access
+
+
+def get(event: Any, path: str, default: Any = None) -> Any:
+    """Returns a value by the specified path if such exists or default."""
+    return accessor(path)(event, default)
+
+
+class Event:
+    """A Qualys IOC event reduced to the values the relay reads.
+
+    Only the top-level fields the CTIM mapping uses are kept, along with
+    the values it reads from the `asset`, `file`, `process` and `network`
+    sections of the event and the active state read by
+    `QUALYS_EVENT_STATE_PATH`. Nothing else of the parsed response is
+    referenced, so it can be released as soon as the events are made.
+    Missing values are `None`.
+
+    The values are also read like keys of the raw event, so paths to them
+    work with `get`.
+    """
+
+    FIELDS = ('id', 'dateTime', 'score', 'indicator2')
+    SECTIONS = {
+        'asset': ('netBiosName', 'fullOSName', 'interfaces'),
+        'file': ('fileName', 'fullPath', 'md5', 'sha256'),
+        'process': ('processName',),
+        'network': ('localIP', 'remoteIP', 'remoteDns'),
+    }
+
+    __slots__ = (*FIELDS, *(key for keys in SECTIONS.values() for key in keys),
+                 'state')
+
+    def __init__(self, id=None, dateTime=None, score=None, indicator2=None,
+                 netBiosName=None, fullOSName=None, interfaces=None,
+                 fileName=None, fullPath=None, md5=None, sha256=None,
+                 processName=None, localIP=None, remoteIP=None,
+                 remoteDns=None, state=None):
+        self.id = id
+        self.dateTime = dateTime
+        self.score = score
+        self.indicator2 = indicator2
+        self.netBiosName = netBiosName
+        self.fullOSName = fullOSName
+        self.interfaces = interfaces
+        self.fileName = fileName
+        self.fullPath = fullPath
+        self.md5 = md5
+        self.sha256 = sha256
+        self.processName = processName
+        self.localIP = localIP
+        self.remoteIP = remoteIP
+        self.remoteDns = remoteDns
+        self.state = state
+
+    @classmethod
+    def of(cls, data: Dict[str, Any], state_path: str = None) -> 'Event':
+        """Makes an event of a parsed Qualys IOC event in one pass."""
+
+        if state_path is None:
+            state_path = current_app.config['QUALYS_EVENT_STATE_PATH']
+
+        state = get(data, state_path)
+        asset = section(data, 'asset')
+        file = section(data, 'file')
+        network = section(data, 'network')
+
+        return cls(
+            data.get('id'), data.get('dateTime'), data.get('score'),
+            data.get('indicator2'),
+            asset.get('netBiosName'), asset.get('fullOSName'),
+            asset.get('interfaces'),
+            file.get('fileName'), file.get('fullPath'), file.get('md5'),
+            file.get('sha256'),
+            section(data, 'process').get('processName'),
+            network.get('localIP'), network.get('remoteIP'),
+            network.get('remoteDns'),
+            state if isinstance(state, bool) else None,
+        )
+
+    @classmethod
+    def parse(cls, data: Any) -> Optional[List['Event']]:
+        """Makes events of a parsed Qualys search result.
+
+        Returns `None` unless the result is a list. Items of the list that
+        are not objects are skipped.
+        """
+
+        if not isinstance(data, list):
+            return None
+
+        state_path = current_app.config['QUALYS_EVENT_STATE_PATH']
+        return [cls.of(item, state_path)
+                for item in data if isinstance(item, dict)]
+
+    def json(self) -> list:
+        """Returns the values as a JSON array in the order of `__slots__`,
+        which is shorter to serialise than an object."""
+        return [getattr(self, key) for key in self.__slots__]
+
+    @classmethod
+    def from_json(cls, data: list) -> 'Event':
+        return cls(*data)
+
+    def __contains__(self, key: str) -> bool:
+        if key in self.SECTIONS:
+            return any(getattr(self, key_) is not None
+                       for key_ in self.SECTIONS[key])
+
+        return key in self.FIELDS and getattr(self, key) is not None
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.SECTIONS:
+            values = ((key_, getattr(self, key_))
+                      for key_ in self.SECTIONS[key])
+            return {key_: value for key_, value in values
+                    if value is not None}
+
+        if key not in self.FIELDS:
+            raise KeyError(key)
+
+        return getattr(self, key)
+
+    def __repr__(self) -> str:
+        return f'Event(id={self.id!r})'
+
+
+def section(data: Dict[str, Any], name: str) -> Dict[str, Any]:
+    """Returns a section of a parsed event, or an empty one if it is
+    missing or not an object."""
+
+    value = data.get(name)
+    return value if isinstance(value, dict) else {}
@@ -1,6 +1,8 @@
-from flask import Blueprint
+from flask import Blueprint, current_app
 
+from api import breaker, cache, limiter
 from api.client import events
+from api.sessions import pool_stats
 from api.utils import jsonify_data
 from api.utils import get_credentials
 
@@ -10,5 +12,12 @@ api = Blueprint('health', __name__)
 @api.route('/health', methods=['POST'])
 def health():
     creds = get_credentials()
-    _ = events(True, 1, creds)
-    return jsonify_data({'status': 'ok'})
+    # The health check is a single call, which must not wait behind
+    # the searches of other requests.
+    with limiter.exempt():
+        _ = events(True, 1, creds, fresh=True)
+    return jsonify_data({
+        'status': 'ok', 'pools': pool_stats(), 'cache': cache.stats(),
+        'breaker': breaker.stats(current_app.config['API_URL']),
+        'limiter': limiter.stats()
+    })
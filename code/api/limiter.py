@@ -0,0 +1,146 @@
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from hashlib import sha256
+from typing import Any, Dict, Iterator, List, Optional
+
+from flask import current_app
+
+from api import deadline
+from api.errors import DeadlineExceededError
+
+try:
+    import fcntl
+except ImportError:
+    # Files cannot be locked, so the buckets are kept per worker process.
+    fcntl = None
+
+# A bucket is stored as the number of tokens and the time it was counted at.
+BUCKET = struct.Struct('dd')
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+# Whether the calls of the current request skip the limits.
+_exempt = ContextVar('exempt', default=False)
+
+_stats = {'requests': 0, 'waited': 0, 'wait_seconds': 0.0, 'max_wait': 0.0}
+_stats_lock = threading.Lock()
+
+
+def acquire(api: str, user: str) -> float:
+    """Waits for the turn of a Qualys call of the user.
+
+    The calls are limited by a token bucket per API URL and user which
+    refills at `QUALYS_RATE_LIMIT` tokens per second up to
+    `QUALYS_RATE_BURST` tokens. Calls over the limit are not rejected but
+    delayed until their token is due, unless that is past the request
+    deadline. Returns the seconds waited.
+    """
+
+    rate = current_app.config['QUALYS_RATE_LIMIT']
+    if rate <= 0 or _exempt.get():
+        return 0.0
+
+    burst = current_app.config['QUALYS_RATE_BURST']
+    key = sha256(f'{api}\n{user}'.encode()).hexdigest()
+
+    wait = reserve(key, rate, burst, deadline.remaining())
+    if wait > 0:
+        time.sleep(wait)
+
+    record(wait)
+    return wait
+
+
+@contextmanager
+def exempt() -> Iterator[None]:
+    """Lets the calls made in the block skip the limits, so they never
+    wait in line behind the searches."""
+
+    token = _exempt.set(True)
+    try:
+        yield
+    finally:
+        _exempt.reset(token)
+
+
+def reserve(key: str, rate: float, burst: float,
+            limit: Optional[float]) -> float:
+    """Takes a token from the bucket, possibly one yet to come.
+
+    Returns the seconds until the token is due.
+    """
+
+    with bucket(key, burst) as state:
+        tokens, counted_at = state
+        now = time.time()
+
+        tokens = min(burst, tokens + max(now - counted_at, 0) * rate)
+        wait = max((1 - tokens) / rate, 0)
+
+        if limit is not None and wait >= limit:
+            raise DeadlineExceededError()
+
+        state[:] = [tokens - 1, now]
+
+    return wait
+
+
+@contextmanager
+def bucket(key: str, burst: float) -> Iterator[List[float]]:
+    """Locks the bucket for the key across worker processes and yields its
+    state to be updated in place."""
+
+    path = current_app.config['QUALYS_RATE_LIMIT_PATH']
+    descriptor = None
+
+    if fcntl is not None:
+        try:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+            descriptor = os.open(os.path.join(path, key),
+                                 os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError as error:
+            current_app.logger.warning(
+                f'Rate limits are kept per process: {error}'
+            )
+
+    if descriptor is None:
+        with _buckets_lock:
+            yield _buckets.setdefault(key, [burst, time.time()])
+        return
+
+    with os.fdopen(descriptor, 'r+b') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+
+        data = file.read(BUCKET.size)
+        state = (list(BUCKET.unpack(data)) if len(data) == BUCKET.size
+                 else [burst, time.time()])
+
+        yield state
+
+        file.seek(0)
+        file.write(BUCKET.pack(*state))
+
+
+def record(wait: float):
+    with _stats_lock:
+        _stats['requests'] += 1
+        if wait > 0:
+            _stats['waited'] += 1
+            _stats['wait_seconds'] += wait
+            _stats['max_wait'] = max(_stats['max_wait'], wait)
+
+
+def stats() -> Dict[str, Any]:
+    """Returns how long the calls of the current worker process waited."""
+
+    with _stats_lock:
+        result = dict(_stats)
+
+    result['wait_seconds'] = round(result['wait_seconds'], 3)
+    result['max_wait'] = round(result['max_wait'], 3)
+    return result
@@ -0,0 +1,249 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+from flask import Blueprint, Response, current_app, g, request
+
+from api import profiling
+
+api = Blueprint('metrics', __name__)
+
+LATENCY = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+FAST = (.00001, .000025, .00005, .0001, .00025, .0005, .001, .0025, .005,
+        .01, .025)
+
+# Names of the metrics with their types, descriptions and histogram buckets.
+METRICS = {
+    'relay_request_duration_seconds': (
+        'histogram', 'Time to handle an inbound request by endpoint.',
+        LATENCY),
+    'relay_outbound_duration_seconds': (
+        'histogram', 'Time to get the response headers of an outbound call '
+                     'by target (auth, events, jwks).', LATENCY),
+    'relay_jwt_verification_seconds': (
+        'histogram', 'Time to verify the JWT of a request, '
+                     'including getting the public key.', LATENCY),
+    'relay_mapping_seconds': (
+        'histogram', 'Time to map a single Qualys event to CTIM.', FAST),
+    'relay_serialization_seconds': (
+        'histogram', 'Time to serialize a CTIM result response.', LATENCY),
+    'relay_cache_requests_total': (
+        'counter', 'Qualys search cache lookups by result.', None),
+    'relay_token_refreshes_total': (
+        'counter', 'Qualys authorization tokens fetched.', None),
+    'relay_errors_total': (
+        'counter', 'Errors returned by code.', None),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# Counter values and histogram bucket counts (the last one for +Inf)
+# followed by their sum, per metric name and labels.
+_values: Dict[Tuple[str, Labels], Any] = {}
+_lock = threading.Lock()
+_flushed_at = 0.0
+
+
+def inc(name: str, amount: float = 1, **labels: str):
+    """Increments a counter."""
+
+    key = name, tuple(sorted(labels.items()))
+
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+    flush_later()
+
+
+def observe(name: str, value: float, count: int = 1, **labels: str):
+    """Records a value in a histogram `count` times, e.g. the average
+    of a batch once per item."""
+
+    buckets = METRICS[name][2]
+    key = name, tuple(sorted(labels.items()))
+
+    with _lock:
+        counts = _values.get(key)
+        if counts is None:
+            counts = _values[key] = [0] * (len(buckets) + 2)
+
+        counts[bisect_left(buckets, value)] += count
+        counts[-1] += value * count
+
+    profiling.record(name, value * count, labels)
+    flush_later()
+
+
+@contextmanager
+def timer(name: str, **labels: str) -> Iterator[None]:
+    """Records the time the block takes in a histogram."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def flush_later():
+    if time.monotonic() - _flushed_at >= \
+            current_app.config['METRICS_FLUSH_INTERVAL']:
+        flush()
+
+
+def flush():
+    """Writes the values of the worker process for the others to read.
+
+    The files are named after the parent (i.e. uWSGI master) process too,
+    so that only the workers of the same master add up.
+    """
+
+    global _flushed_at
+    _flushed_at = time.monotonic()
+
+    with _lock:
+        values = [[name, labels, value]
+                  for (name, labels), value in _values.items()]
+
+    path = current_app.config['METRICS_PATH']
+    name = os.path.join(path, f'{os.getppid()}-{os.getpid()}.json')
+
+    temporary = f'{name}.{threading.get_ident()}.tmp'
+
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        with open(temporary, 'w') as file:
+            json.dump(values, file)
+        os.replace(temporary, name)
+    except OSError as error:
+        current_app.logger.warning(f'Unable to write metrics: {error}')
+
+
+def collect() -> Dict[Tuple[str, Labels], Any]:
+    """Adds up the values of all the workers of the same master."""
+
+    flush()
+
+    path = current_app.config['METRICS_PATH']
+    prefix = f'{os.getppid()}-'
+    result = {}
+
+    for file_name in os.listdir(path):
+        if not file_name.startswith(prefix):
+            remove_stale(os.path.join(path, file_name))
+            continue
+
+        if not file_name.endswith('.json'):
+            continue
+
+        try:
+            with open(os.path.join(path, file_name)) as file:
+                values = json.load(file)
+        except (OSError, ValueError):
+            continue
+
+        for name, labels, value in values:
+            key = name, tuple(map(tuple, labels))
+
+            if isinstance(value, list):
+                total = result.setdefault(key, [0] * len(value))
+                result[key] = [a + b for a, b in zip(total, value)]
+            else:
+                result[key] = result.get(key, 0) + value
+
+    return result
+
+
+def remove_stale(file_name: str):
+    """Removes a file left by the workers of a master that is gone."""
+
+    try:
+        os.kill(int(os.path.basename(file_name).split('-')[0]), 0)
+    except ProcessLookupError:
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
+    except (OSError, ValueError):
+        pass
+
+
+def render(values: Dict[Tuple[str, Labels], Any]) -> str:
+    """Renders the values in the Prometheus text format."""
+
+    lines: List[str] = []
+
+    for name, (type_, help_, buckets) in METRICS.items():
+        series = sorted((labels, value) for (name_, labels), value
+                        in values.items() if name_ == name)
+        if not series:
+            continue
+
+        lines.append(f'# HELP {name} {help_}')
+        lines.append(f'# TYPE {name} {type_}')
+
+        for labels, value in series:
+            if type_ == 'counter':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+
+            cumulative = 0
+            for bound, count in zip([*buckets, '+Inf'], value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket'
+                             f'{format_labels((*labels, ("le", bound)))}'
+                             f' {cumulative}')
+
+            lines.append(f'{name}_sum{format_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+
+    def escape(value):
+        return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n'))
+
+    pairs = ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+    return f'{{{pairs}}}'
+
+
+@api.before_app_request
+def start_timer():
+    g.request_started_at = time.perf_counter()
+
+
+@api.after_app_request
+def stop_timer(response):
+    started_at = g.pop('request_started_at', None)
+    if started_at is not None:
+        rule = request.url_rule
+        observe('relay_request_duration_seconds',
+                time.perf_counter() - started_at,
+                endpoint=rule.rule if rule else 'unknown',
+                status=str(response.status_code))
+
+    # Publish the values of the request once it is served, even if the
+    # worker gets no more requests to flush them with.
+    app = current_app._get_current_object()
+
+    def flush_():
+        with app.app_context():
+            flush()
+
+    response.call_on_close(flush_)
+    return response
+
+
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render(collect()),
+                    mimetype='text/plain; version=0.0.4')
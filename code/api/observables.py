@@ -1,13 +1,25 @@
+import time
 from abc import ABCMeta, abstractmethod
-from collections import defaultdict
-from itertools import chain
-from typing import Optional, Dict, Any, Iterable, List
+from concurrent.futures import Future
+from ipaddress import ip_address
+from itertools import chain, product
+from typing import (
+    Optional, Dict, Any, Iterable, Iterator, List, Callable, Set, Tuple
+)
 from urllib.parse import quote
 from uuid import uuid4, uuid5
 
 from flask import current_app
 
-from . import client
+from . import client, metrics
+from .events import Event
+
+# Instances of the registered `Observable` subclasses by their types.
+_observables = {}
+
+# API URLs whose events turned out to carry no active state,
+# so the active events have to be searched separately.
+_stateless_apis = set()
 
 
 class Observable(metaclass=ABCMeta):
@@ -17,13 +29,11 @@ class Observable(metaclass=ABCMeta):
 
     @staticmethod
     def of(type_: str) -> Optional['Observable']:
-        """Returns an instance of `Observable` for the specified type."""
-
-        for cls in Observable.__subclasses__():
-            if cls.type() == type_:
-                return cls()
+        """Returns an instance of `Observable` for the specified type.
 
-        return None
+        The instance is shared, since observables hold no state.
+        """
+        return _observables.get(type_)
 
     @staticmethod
     @abstractmethod
@@ -44,64 +54,278 @@ class Observable(metaclass=ABCMeta):
     def filter(self, observable: str) -> str:
         """Returns a filter to search for the provided observable."""
 
-    def observe(self, observable: str, limit: int, creds: dict) \
-            -> Dict[str, Any]:
-        """Retrieves objects (sightings, verdicts, etc.) for an observable."""
+    @staticmethod
+    def normalize(observable: str) -> str:
+        """Returns the canonical form of the provided observable.
+
+        Observables of the same canonical form are searched only once.
+        """
+        return observable
+
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        """Returns paths to the event fields the observable is searched by.
 
-        data = defaultdict(list)
+        The paths let events found for several observables at once be told
+        apart, so they must cover every field `filter` matches and lead to
+        values kept by `Event`. Observables of a type without such paths
+        are never batched.
+        """
+        return ()
 
-        def truncate(name, objects):
-            return objects[:limit - len(data.get(name, []))]
+    def observe(self, observable: str, limit: int, creds: dict,
+                search: Callable[[bool, int], List[Event]] = None,
+                seen: Set[str] = None) -> Dict[str, Any]:
+        """Retrieves objects (sightings, verdicts, etc.) for an observable.
 
-        for active in [True, False]:
-            amount = limit - len(data.get('sightings', []))
-            events = client.events(active, amount, creds,
-                                   quote(self.filter(observable)))
+        The events are searched by `search(active, amount)` if provided
+        (e.g. one returned from `prefetch`) or straight in Qualys otherwise.
 
-            # Map received events to CTIM objects
-            # and append them to the result.
-            for event in events:
-                sightings = [self._sighting(event, observable, active)]
-                sightings = truncate('sightings', sightings)
+        Objects get IDs derived from their content, so the same object is
+        returned only once. Passing the same `seen` set of IDs to several
+        calls extends that to all of them, e.g. an indicator of an event
+        found for several observables is built and returned just once.
+        """
 
-                if event.get('score') is not None:
-                    indicators = [self._indicator(event)]
-                    indicators = truncate('indicators', indicators)
-                else:
-                    indicators = []
+        seen = set() if seen is None else seen
 
-                judgements = self._judgements(event, observable)
-                judgements = truncate('judgements', judgements)
+        if search is None:
+            def search(active_, amount_):
+                return client.events(active_, amount_, creds,
+                                     quote(self.filter(observable)))
 
-                relationships = list(chain(
-                    self._relationships(judgements, 'based-on', indicators),
-                    self._relationships(sightings, 'based-on', judgements),
-                    self._relationships(sightings, 'sighting-of', indicators),
-                ))
+        events = self.events(limit, search)
 
-                data['sightings'].extend(sightings)
-                data['indicators'].extend(indicators)
-                data['judgements'].extend(judgements)
-                data['relationships'].extend(relationships)
+        started_at = time.perf_counter()
+        data = self.map(observable, events, limit, seen)
+
+        if events:
+            metrics.observe('relay_mapping_seconds',
+                            (time.perf_counter() - started_at) / len(events),
+                            count=len(events))
 
         return data
 
+    def map(self, observable: str, events: List[Tuple[bool, Event]],
+            limit: int, seen: Set[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """Maps a batch of events paired with their active state to CTIM.
+
+        The objects are built only for the IDs `plan` yields, along with the
+        relationships between them.
+        """
+
+        data = {'sightings': [], 'indicators': [], 'judgements': [],
+                'relationships': []}
+
+        for active, fields, sighting, indicator, related, judgements \
+                in self.plan(observable, events, limit, seen):
+            if sighting is not None:
+                data['sightings'].append(
+                    self._sighting(fields, observable, active, sighting)
+                )
+            if indicator is not None:
+                data['indicators'].append(self._indicator(fields, indicator))
+
+            for index, id_ in judgements:
+                data['judgements'].append(
+                    self._judgement(fields, observable, index, id_)
+                )
+
+            sightings = [sighting] if sighting is not None else []
+            indicators = [related] if related is not None else []
+            judgement_ids = [id_ for _, id_ in judgements]
+
+            for source, relation, target in chain(
+                    product(judgement_ids, ['based-on'], indicators),
+                    product(sightings, ['based-on'], judgement_ids),
+                    product(sightings, ['sighting-of'], indicators),
+            ):
+                id_ = self.get_transient_id('relationship', source,
+                                            relation, target)
+                if id_ not in seen:
+                    seen.add(id_)
+                    data['relationships'].append(
+                        self._relationship(source, relation, target, id_)
+                    )
+
+        return data
+
+    def plan(self, observable: str,
+             events: Iterable[Tuple[bool, Event]], limit: int,
+             seen: Set[str]) -> Iterator[tuple]:
+        """Yields the IDs of the objects to build per event.
+
+        Works them out from the IDs alone, checking the budget of each kind
+        of objects first: objects in `seen` are left out, and each kind is
+        cut at `limit`. The indicator the objects of an event relate to is
+        yielded as `related` even if returned already, but only while there
+        are sightings or judgements left to relate to it. The events are
+        no longer read once every kind is full.
+        """
+
+        type_ = self.type()
+        budget = dict.fromkeys(['sightings', 'indicators', 'judgements'],
+                               limit)
+
+        def take(kind, id_):
+            if id_ in seen:
+                return False
+
+            budget[kind] -= 1
+            seen.add(id_)
+            return True
+
+        for active, event in events:
+            if not any(budget.values()):
+                return
+
+            fields = read(event)
+            sighting = indicator = related = None
+            judgements = []
+
+            if budget['sightings']:
+                id_ = self.get_transient_id('sighting', fields['id'],
+                                            type_, observable)
+                if take('sightings', id_):
+                    sighting = id_
+
+            for index in range(len(fields['indicator2'])):
+                if not budget['judgements']:
+                    break
+
+                id_ = self.get_transient_id('judgement', fields['id'], index,
+                                            type_, observable)
+                if take('judgements', id_):
+                    judgements.append((index, id_))
+
+            if fields['score'] is not None and (
+                    budget['indicators'] or sighting or judgements
+            ):
+                id_ = self.get_transient_id('indicator', fields['id'])
+                if id_ in seen:
+                    related = id_
+                elif budget['indicators'] and take('indicators', id_):
+                    indicator = related = id_
+
+            yield active, fields, sighting, indicator, related, judgements
+
+    @staticmethod
+    def events(limit: int,
+               search: Callable[[bool, int], List[Event]]) \
+            -> List[Tuple[bool, Event]]:
+        """Returns up to `limit` events paired with their active state.
+
+        Active events go first. If the events carry their state, a single
+        search for events of any state is enough as long as it finds fewer
+        than `limit` events or only active ones. Otherwise, the active events
+        are searched separately, and the rest of the limit is filled with the
+        inactive events found, or, if the events themselves are of no help,
+        with events of any state.
+        """
+
+        api = current_app.config['API_URL']
+        events = states = None
+
+        if single_query(api):
+            events = search(False, limit)[:limit]
+            states = [state(event) for event in events]
+
+            if complete(events, limit):
+                return [
+                    *((True, e) for e, s in zip(events, states) if s),
+                    *((False, e) for e, s in zip(events, states) if not s),
+                ]
+
+            if None in states:
+                _stateless_apis.add(api)
+                states = None
+
+        active = search(True, limit)[:limit]
+        amount = limit - len(active)
+
+        if amount <= 0:
+            rest = []
+        elif states is not None:
+            rest = [e for e, s in zip(events, states) if not s][:amount]
+        elif events is not None:
+            rest = events[:amount]
+        else:
+            rest = search(False, amount)
+
+        return [*((True, e) for e in active), *((False, e) for e in rest)]
+
+    def prefetch(self, observable: str, limit: int, creds: dict,
+                 submit: Callable[..., Future]) \
+            -> Callable[[bool, int], List[Event]]:
+        """Schedules the searches of `events` to run ahead of time.
+
+        The searches `events` is expected to make are requested at once with
+        the full limit, so they can run in parallel. If the search for events
+        of any state turns out to be not enough, the search for the active
+        ones follows it in the same task. The returned function then hands
+        out the first `amount` of events, i.e. exactly what `observe` would
+        have got by searching for `amount` events in order. Any other search
+        is made on demand.
+        """
+
+        filter_ = quote(self.filter(observable))
+        single = single_query(current_app.config['API_URL'])
+
+        def fetch(active: bool) -> Dict[bool, List[Event]]:
+            found = {active: client.events(active, limit, creds, filter_)}
+            if single and not complete(found[active], limit):
+                found[True] = client.events(True, limit, creds, filter_)
+
+            return found
+
+        if single:
+            futures = dict.fromkeys([True, False], submit(fetch, False))
+        else:
+            futures = {active: submit(fetch, active)
+                       for active in [True, False]}
+
+        def search(active: bool, amount: int) -> List[Event]:
+            future = futures[active]
+            if amount <= 0:
+                future.cancel()
+                return []
+
+            found = future.result()
+            if active not in found:
+                return client.events(active, amount, creds, filter_)
+
+            return found[active][:amount]
+
+        return search
+
     def refer(self, api: str, observable: str) -> str:
         """Returns a URL for pivoting back to Qualys."""
         return f'{api}/ioc/#/hunting?search={quote(self.filter(observable))}'
 
     @classmethod
-    def _sighting(cls, event: Dict[str, Any], observable: str, active: bool) \
-            -> Dict[str, Any]:
-        """Constructs a single CTIM sighting from a Qualys IOC event."""
+    def _sighting(cls, fields: Dict[str, Any], observable: str,
+                  active: bool, id_: str = None) -> Dict[str, Any]:
+        """Constructs a single CTIM sighting from fields of a Qualys IOC event.
 
-        return clean({
-            'id': f'transient:sighting-{uuid4()}',
+        The fields are expected to be read from the event with `read`. Like
+        the other builders, it leaves out fields without values rather than
+        setting them to `None`, and takes the ID if it is known already.
+        """
+
+        target = {
+            'observables': fields['targets'],
+            'observed_time': fields['observed_time'],
+            'type': 'endpoint',
+        }
+        if fields['os'] is not None:
+            target['os'] = fields['os']
+
+        return {
+            'id': id_ or cls.get_transient_id('sighting', fields['id'],
+                                              cls.type(), observable),
             'confidence': 'High',
             'count': 1,
-            'external_ids': [
-                get(event, '.id')
-            ],
+            'external_ids': fields['external_ids'],
             'external_references': [],
             'observables': [
                 {
@@ -109,26 +333,13 @@ class Observable(metaclass=ABCMeta):
                     'value': observable
                 }
             ],
-            'observed_time': {
-                'start_time': get(event, '.dateTime'),
-                'end_time': get(event, '.dateTime')
-            },
-            'relations': list(relations(event)),
+            'observed_time': fields['observed_time'],
+            'relations': fields['relations'],
             'schema_version': cls.SCHEMA,
-            'severity': severity(event),
+            'severity': fields['severity'],
             'sensor': 'endpoint',
             'source': 'Qualys IOC',
-            'targets': [
-                {
-                    'observables': list(targets(event)),
-                    'observed_time': {
-                        'start_time': get(event, '.dateTime'),
-                        'end_time': get(event, '.dateTime')
-                    },
-                    'type': 'endpoint',
-                    'os': get(event, '.asset.fullOSName')
-                }
-            ],
+            'targets': [target],
             'type': 'sighting',
             'description': f'A Qualys IOC event related to "{observable}"',
             'data': {
@@ -136,132 +347,110 @@ class Observable(metaclass=ABCMeta):
                 'rows': [[str(active)]],
                 'row_count': 1
             },
-        })
+        }
 
     @staticmethod
-    def get_transient_id(entity_type, base_value=None):
-        uuid = (uuid5(current_app.config['NAMESPACE_BASE'], base_value)
-                if base_value else uuid4())
+    def get_transient_id(entity_type, *base_values):
+        """Returns an ID derived from the base values if all of them are set
+        or a random one otherwise."""
+
+        uuid = (uuid5(current_app.config['NAMESPACE_BASE'],
+                      '\n'.join(map(str, base_values)))
+                if base_values and all(value not in (None, '')
+                                       for value in base_values)
+                else uuid4())
         return f'transient:{entity_type}-{uuid}'
 
     @staticmethod
     def get_title(score: str) -> str:
-        titles = {
-            '0': 'Known Good',
-            '1': 'Remediated',
-            '2': 'Suspicious Low File event',
-            '3': 'Suspicious Low Process event',
-            '4': 'Suspicious Low Network event',
-            '5': 'Suspicious Medium File event',
-            '6': 'Suspicious Medium Process event',
-            '7': 'Suspicious Medium Network event',
-            '8': 'Malicious File event',
-            '9': 'Malicious Process event',
-            '10': 'Malicious Network event'
-        }
-        return titles[score]
+        return TITLES[score]
 
     @classmethod
-    def _indicator(cls, event: Dict[str, Any]) \
+    def _indicator(cls, fields: Dict[str, Any], id_: str = None) \
             -> Dict[str, Any]:
-        """Constructs a single CTIM indicator from a Qualys IOC event."""
+        """Constructs a single CTIM indicator from fields of a Qualys IOC
+        event."""
 
-        return clean({
-            'title': cls.get_title(event['score']),
-            'id': cls.get_transient_id('indicator', event['id']),
+        return {
+            'title': TITLES[fields['score']],
+            'id': id_ or cls.get_transient_id('indicator', fields['id']),
             'type': 'indicator',
             'schema_version': cls.SCHEMA,
             'source': 'Qualys IOC',
             'producer': 'Qualys IOC',
-            'severity': severity(event),
+            'severity': fields['severity'],
             'valid_time': {},
-            'external_ids': [
-                get(event, '.id')
-            ],
+            'external_ids': fields['external_ids'],
             'confidence': 'High',
-        })
+        }
 
     @classmethod
-    def _judgements(cls, event: Dict[str, Any], observable: str) \
-            -> List[Dict[str, Any]]:
-        """Constructs CTIM judgements from a Qualys IOC event."""
-
-        dispositions = {
-            'Clean': 1,
-            'Malicious': 2,
-            'Suspicious': 3,
-            'Common': 4,
-            'Unknown': 5,
-        }
-        disposition_names = {
-            'KNOWN': 'Clean',
-            'UNKNOWN': 'Unknown',
-            'SUSPICIOUS': 'Suspicious',
-            'MALICIOUS': 'Malicious',
-            'REMEDIATED': 'Malicious',
+    def _judgement(cls, fields: Dict[str, Any], observable: str, index: int,
+                   id_: str = None) -> Dict[str, Any]:
+        """Constructs a CTIM judgement from the verdict at the index."""
+
+        indicator2 = fields['indicator2'][index]
+        disposition, disposition_name = DISPOSITIONS.get(
+            indicator2.get('verdict'), DISPOSITIONS[None]
+        )
+
+        judgement = {
+            'id': id_ or cls.get_transient_id('judgement', fields['id'],
+                                              index, cls.type(), observable),
+            'confidence': 'High',
+            'disposition': disposition,
+            'disposition_name': disposition_name,
+            'external_ids': fields['external_ids'],
+            'external_references': [],
+            'observable': {
+                'type': cls.type(),
+                'value': observable
+            },
+            'priority': 90,
+            'schema_version': cls.SCHEMA,
+            'severity': fields['severity'],
+            'source': 'Qualys IOC',
+            'type': 'judgement',
+            'valid_time': {}
         }
 
-        judgements = []
+        reason = indicator2.get('threatName', '')
+        if reason is not None:
+            judgement['reason'] = reason
 
-        for indicator2 in get(event, '.indicator2') or []:
-            verdict = indicator2.get('verdict')
+        return judgement
 
-            disposition_name = disposition_names.get(verdict) or 'Unknown'
-            disposition = dispositions[disposition_name]
+    @classmethod
+    def _relationship(cls, source: str, type_: str, target: str,
+                      id_: str = None) -> Dict[str, Any]:
+        """Constructs a CTIM relationship between objects with the IDs."""
+
+        return {
+            'id': id_ or cls.get_transient_id('relationship', source, type_,
+                                              target),
+            'type': 'relationship',
+            'schema_version': cls.SCHEMA,
+            'source': 'Qualys IOC',
+            'source_uri': '',
+            'source_ref': source,
+            'target_ref': target,
+            'relationship_type': type_,
+            'external_ids': []
+        }
 
-            judgement = clean({
-                'id': f'transient:judgement-{uuid4()}',
-                'confidence': 'High',
-                'disposition': disposition,
-                'disposition_name': disposition_name,
-                'external_ids': [
-                    get(event, '.id')
-                ],
-                'external_references': [],
-                'observable': {
-                    'type': cls.type(),
-                    'value': observable
-                },
-                'priority': 90,
-                'reason': indicator2.get('threatName', ''),
-                'schema_version': cls.SCHEMA,
-                'severity': severity(event),
-                'source': 'Qualys IOC',
-                'type': 'judgement',
-                'valid_time': {}
-            })
-            judgements.append(judgement)
-
-        return judgements
 
-    @classmethod
-    def _relationships(cls,
-                       sources_: Iterable[Dict[str, Any]],
-                       type_: str,
-                       targets_: Iterable[Dict[str, Any]]) \
-            -> List[Dict[str, Any]]:
-        """Constructs CTIM relationships between source and target objects."""
-
-        relationships = []
-
-        for source in sources_:
-            for target in targets_:
-                relationship = clean({
-                    'id': f'transient:relationship-{uuid4()}',
-                    'type': 'relationship',
-                    'schema_version': cls.SCHEMA,
-                    'source': 'Qualys IOC',
-                    'source_uri': '',
-                    'source_ref': source['id'],
-                    'target_ref': target['id'],
-                    'relationship_type': type_,
-                    'external_ids': []
-                })
-                relationships.append(relationship)
-
-        return relationships
+def register(cls):
+    """Registers an `Observable` subclass to handle observables of its type.
+
+    Meant to be used as a class decorator. Besides this module, it may be
+    used by any module listed in the `OBSERVABLE_PLUGINS` setting.
+    """
+
+    _observables[cls.type()] = cls()
+    return cls
 
 
+@register
 class MD5(Observable):
 
     @staticmethod
@@ -275,7 +464,16 @@ class MD5(Observable):
     def filter(self, observable: str) -> str:
         return f'file.hash.md5: "{observable}"'
 
+    @staticmethod
+    def normalize(observable: str) -> str:
+        return observable.strip().lower()
 
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        return ('.file.md5',)
+
+
+@register
 class SHA256(Observable):
 
     @staticmethod
@@ -289,7 +487,16 @@ class SHA256(Observable):
     def filter(self, observable: str) -> str:
         return f'file.hash.sha256: "{observable}"'
 
+    @staticmethod
+    def normalize(observable: str) -> str:
+        return observable.strip().lower()
 
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        return ('.file.sha256',)
+
+
+@register
 class FileName(Observable):
 
     @staticmethod
@@ -303,7 +510,12 @@ class FileName(Observable):
     def filter(self, observable: str) -> str:
         return f'file.name: "{observable}"'
 
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        return ('.file.fileName',)
 
+
+@register
 class FilePath(Observable):
 
     @staticmethod
@@ -317,7 +529,12 @@ class FilePath(Observable):
     def filter(self, observable: str) -> str:
         return f'file.fullPath: "{observable}"'
 
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        return ('.file.fullPath',)
 
+
+@register
 class IP(Observable):
 
     @staticmethod
@@ -332,7 +549,25 @@ class IP(Observable):
         return (f'network.local.address.ip: "{observable}" or '
                 f'network.remote.address.ip: "{observable}"')
 
+    @staticmethod
+    def normalize(observable: str) -> str:
+        try:
+            address = ip_address(observable.strip())
+        except ValueError:
+            return observable
+
+        # Keep IPv4-mapped addresses readable, e.g. ::ffff:1.2.3.4.
+        if getattr(address, 'ipv4_mapped', None):
+            return f'::ffff:{address.ipv4_mapped}'
+
+        return str(address)
 
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        return ('.network.localIP', '.network.remoteIP')
+
+
+@register
 class Domain(Observable):
 
     @staticmethod
@@ -346,7 +581,20 @@ class Domain(Observable):
     def filter(self, observable: str) -> str:
         return f'network.remote.address.fqdn: "{observable}"'
 
+    @staticmethod
+    def normalize(observable: str) -> str:
+        domain = observable.strip().rstrip('.').lower()
+        try:
+            return domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return domain
+
+    @staticmethod
+    def paths() -> Tuple[str, ...]:
+        return ('.network.remoteDns',)
+
 
+@register
 class Mutex(Observable):
 
     @staticmethod
@@ -361,67 +609,12 @@ class Mutex(Observable):
         return f'handle.name: "{observable}"'
 
 
-def get(event: Dict[str, Any], path: str, default: Any = None) -> Any:
-    """Returns a value by the specified path if such exists or default."""
-
-    result = event
-    parts = iter(path.split('.'))
-
-    # Skip the first entry.
-    # It is always empty due to the leading period.
-    next(parts)
-
-    for part in parts:
-        if part in result:
-            result = result[part]
-        else:
-            return default
-
-    return result
-
-
-def clean(data: Any) -> Any:
-    """Recursively cleans a `dict` or a `list` from 'None' values."""
-
-    if isinstance(data, list):
-        return [x for x in map(clean, data) if x is not None]
-
-    if isinstance(data, dict):
-        result = {key: clean(value) for key, value in data.items()}
-        result = {key: value for key, value in result.items()
-                  if value is not None}
-
-        return result
-
-    return data
-
-
-def relations(event: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
-    """Constructs relations based on the provided event."""
-
-    def mapped(relations_):
-        for source, relation, target in relations_:
-            source_type, source_path = source
-            target_type, target_path = target
-
-            source_value = get(event, source_path)
-            target_value = get(event, target_path)
-
-            if source_value and target_value:
-                yield {
-                    "origin": 'Qualys IOC',
-                    "related": {
-                        "type": target_type,
-                        "value": target_value
-                    },
-                    "relation": relation,
-                    "source": {
-                        "type": source_type,
-                        "value": source_value
-                    }
-                }
-
-    return mapped([
+# Relations between values of events as `(source type, source key,
+# relation, target type, target key)`, the keys being `Event` attributes.
+RELATIONS = [
+    (source_type, source_path.rsplit('.', 1)[1], relation,
+     target_type, target_path.rsplit('.', 1)[1])
+    for (source_type, source_path), relation, (target_type, target_path) in [
         # Relations from `.file`.
         (['file_name', '.file.fileName'], 'File_Name_Of',
          ['sha256',    '.file.sha256']),
@@ -441,23 +634,117 @@ def relations(event: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
         # Relations from `.network`.
         (['ip',     '.network.remoteIP'], 'Resolved_To',
          ['domain', '.network.remoteDns']),
-    ])
+    ]
+]
+
+# Indicator titles by event scores.
+TITLES = {
+    '0': 'Known Good',
+    '1': 'Remediated',
+    '2': 'Suspicious Low File event',
+    '3': 'Suspicious Low Process event',
+    '4': 'Suspicious Low Network event',
+    '5': 'Suspicious Medium File event',
+    '6': 'Suspicious Medium Process event',
+    '7': 'Suspicious Medium Network event',
+    '8': 'Malicious File event',
+    '9': 'Malicious Process event',
+    '10': 'Malicious Network event'
+}
+
+# Judgement dispositions and their names by verdicts,
+# with the one of unknown verdicts under `None`.
+DISPOSITIONS = {
+    'KNOWN': (1, 'Clean'),
+    'UNKNOWN': (5, 'Unknown'),
+    'SUSPICIOUS': (3, 'Suspicious'),
+    'MALICIOUS': (2, 'Malicious'),
+    'REMEDIATED': (2, 'Malicious'),
+    None: (5, 'Unknown'),
+}
+
+
+def read(event: Event) -> Dict[str, Any]:
+    """Reads all the fields of an event the CTIM mapping needs at once.
+
+    Parts of CTIM documents that only depend on the event are built here,
+    so documents of the same event share them and must not modify them.
+    """
 
+    id_ = event.id
+    date_time = event.dateTime
+
+    return {
+        'id': id_,
+        'external_ids': [id_] if id_ is not None else [],
+        'observed_time': {
+            'start_time': date_time,
+            'end_time': date_time
+        } if date_time is not None else {},
+        'score': event.score,
+        'severity': severity(event),
+        'os': event.fullOSName,
+        'relations': list(relations(event)),
+        'targets': list(targets(event)),
+        'indicator2': event.indicator2 or [],
+    }
 
-def targets(event: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+
+def single_query(api: str) -> bool:
+    """Tells whether events of the API are expected to carry their state."""
+    return (current_app.config['QUALYS_SINGLE_QUERY']
+            and api not in _stateless_apis)
+
+
+def complete(events: List[Event], limit: int) -> bool:
+    """Tells whether a search for `limit` events of any state is all
+    `Observable.events` needs, i.e. no search for the active ones follows."""
+
+    states = [state(event) for event in events[:limit]]
+    return None not in states and (len(states) < limit or all(states))
+
+
+def state(event: Event) -> Optional[bool]:
+    """Returns whether an event is in the active state if it is known."""
+    return event.state
+
+
+def relations(event: Event) -> Iterable[Dict[str, Any]]:
+    """Constructs relations based on the provided event."""
+
+    for source_type, source, relation, target_type, target in RELATIONS:
+        source_value = getattr(event, source)
+        target_value = getattr(event, target)
+
+        if source_value and target_value:
+            yield {
+                "origin": 'Qualys IOC',
+                "related": {
+                    "type": target_type,
+                    "value": target_value
+                },
+                "relation": relation,
+                "source": {
+                    "type": source_type,
+                    "value": source_value
+                }
+            }
+
+
+def targets(event: Event) -> Iterable[Dict[str, Any]]:
     """Constructs targets based on the provided event."""
 
-    if event['asset'].get('netBiosName'):
-        yield {'type': 'hostname', 'value': event['asset']['netBiosName']}
+    if event.netBiosName:
+        yield {'type': 'hostname', 'value': event.netBiosName}
 
-    for interface in event['asset'].get('interfaces') or []:
+    for interface in event.interfaces or []:
         if interface.get('ipAddress'):
             yield {'type': 'ip', 'value': interface['ipAddress']}
         if interface.get('macAddress'):
             yield {'type': 'mac_address', 'value': interface['macAddress']}
 
 
-def severity(event: Dict[str, Any]) -> str:
+def severity(event: Event) -> str:
     """Maps `score` of a Qualys event to `severity`.
 
     Possible `score` values:
@@ -474,9 +761,6 @@ def severity(event: Dict[str, Any]) -> str:
         10 = Malicious Network event
     """
 
-    if 'score' not in event:
-        return 'Unknown'
-
     scores = {
         '0': 'None',
         '1': 'High',
@@ -491,6 +775,4 @@ def severity(event: Dict[str, Any]) -> str:
         '10': 'High'
     }
 
-    score = event['score']
-
-    return scores.get(score, 'Unknown')
+    return scores.get(event.score, 'Unknown')
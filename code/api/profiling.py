@@ -0,0 +1,193 @@
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import ContextManager, Dict, Iterator
+from uuid import uuid4
+
+from flask import Blueprint, current_app, request
+
+api = Blueprint('profiling', __name__)
+
+# Server-Timing names of the phases recorded by the `metrics` histograms.
+# Outbound calls are named after their targets.
+PHASES = {
+    'relay_jwt_verification_seconds': 'jwt',
+    'relay_mapping_seconds': 'mapping',
+    'relay_serialization_seconds': 'serialization',
+}
+
+# The profile of the current request if it is being profiled.
+# Tasks submitted with `utils.submitter` inherit it.
+_profile = ContextVar('profile', default=None)
+
+
+class Profile:
+    """Samples the call stacks of the threads serving a single request
+    and adds up the time spent in each phase of the request."""
+
+    def __init__(self, interval: float):
+        self.started_at = time.perf_counter()
+        self.threads = {threading.get_ident()}
+        self.phases = defaultdict(lambda: [0.0, 0])
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample,
+                                         args=(interval,), daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            total = self.phases[phase]
+            total[0] += seconds
+            total[1] += 1
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        """Samples the current thread too while in the block."""
+
+        ident = threading.get_ident()
+        with self._lock:
+            self.threads.add(ident)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.threads.discard(ident)
+
+    def collapsed(self) -> str:
+        """Returns the samples in the collapsed stack format."""
+        return ''.join(f'{stack} {count}\n'
+                       for stack, count in self.stacks.most_common())
+
+    def server_timing(self) -> str:
+        """Returns the phases as a `Server-Timing` header value."""
+
+        total = (time.perf_counter() - self.started_at) * 1000
+        metrics = [f'total;dur={total:.1f}']
+
+        with self._lock:
+            phases = dict(self.phases)
+
+        for phase, (seconds, count) in phases.items():
+            metrics.append(f'{phase};dur={seconds * 1000:.1f}'
+                           f';desc="{count}x"')
+
+        return ', '.join(metrics)
+
+    def _sample(self, interval: float):
+        while not self._stopped.wait(interval):
+            frames = sys._current_frames()
+
+            with self._lock:
+                threads = list(self.threads)
+
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[stack(frame)] += 1
+
+
+def stack(frame) -> str:
+    """Returns the call stack of a frame, the outermost call first."""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} '
+                     f'({os.path.basename(code.co_filename)}'
+                     f':{code.co_firstlineno})')
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+def record(metric: str, seconds: float, labels: Dict[str, str]):
+    """Adds the time recorded by a `metrics` histogram to the profile
+    of the current request if it is being profiled."""
+
+    profile = _profile.get()
+    if profile is None:
+        return
+
+    phase = labels.get('target') or PHASES.get(metric)
+    if phase is not None:
+        profile.add(phase, seconds)
+
+
+def thread() -> ContextManager[None]:
+    """Samples the current thread while in the block if the request it
+    works for is being profiled."""
+
+    profile = _profile.get()
+    return profile.thread() if profile is not None else nullcontext()
+
+
+def requested() -> bool:
+    config = current_app.config
+    if config['PROFILE_REQUESTS']:
+        return True
+
+    token = config['PROFILE_TOKEN']
+    value = request.headers.get(config['PROFILE_HEADER'])
+
+    return bool(token and value
+                and hmac.compare_digest(value.encode(), token.encode()))
+
+
+@api.before_app_request
+def start_profile():
+    if not requested():
+        return
+
+    profile = Profile(current_app.config['PROFILE_INTERVAL'])
+    profile.start()
+    _profile.set(profile)
+
+
+@api.after_app_request
+def stop_profile(response):
+    profile = _profile.get()
+    if profile is None:
+        return response
+
+    _profile.set(None)
+    profile.stop()
+
+    path = current_app.config['PROFILE_PATH']
+    file_name = f'{int(time.time())}-{uuid4().hex[:8]}.collapsed'
+
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        with open(os.path.join(path, file_name), 'w') as file:
+            file.write(profile.collapsed())
+    except OSError as error:
+        current_app.logger.warning(f'Unable to write a profile: {error}')
+        file_name = None
+
+    timing = profile.server_timing()
+    if file_name:
+        timing += f', profile;desc="{file_name}"'
+
+    response.headers['Server-Timing'] = timing
+    return response
+
+
+@api.teardown_app_request
+def discard_profile(_):
+    # Stop sampling if the request failed before a response was made.
+    profile = _profile.get()
+    if profile is not None:
+        _profile.set(None)
+        profile.stop()
@@ -0,0 +1,124 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Tuple
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from urllib3.exceptions import ReadTimeoutError
+
+from api import deadline, metrics
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    """Returns the HTTP session shared by all threads of a worker process.
+
+    The session keeps a pool of keep-alive connections per host, so the
+    TCP and TLS handshakes are made only once per connection.
+    """
+
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+
+    return _session
+
+
+def create_session() -> requests.Session:
+    adapter = HTTPAdapter(
+        pool_connections=current_app.config['HTTP_POOL_CONNECTIONS'],
+        pool_maxsize=current_app.config['HTTP_POOL_MAXSIZE'],
+    )
+
+    session_ = requests.Session()
+    session_.mount('https://', adapter)
+    session_.mount('http://', adapter)
+
+    # The session is shared by all tenants, so never keep any cookies.
+    session_.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+    return session_
+
+
+def timeout() -> Tuple[float, float]:
+    """Returns the connect and read timeouts for outbound requests.
+
+    The timeouts are cut to what is left until the deadline of the current
+    request, and no requests are made once the deadline is exceeded.
+    """
+
+    deadline.check()
+
+    connect = current_app.config['HTTP_CONNECT_TIMEOUT']
+    read = current_app.config['HTTP_READ_TIMEOUT']
+
+    left = deadline.remaining()
+    if left is not None:
+        connect, read = min(connect, left), min(read, left)
+
+    return connect, read
+
+
+def read_timed_out(error: Exception) -> bool:
+    """Tells whether the error is a read timeout hit while reading the body
+    of a response, which `requests` raises as a `ConnectionError`."""
+
+    return isinstance(error, ConnectionError) and any(
+        isinstance(arg, ReadTimeoutError) for arg in error.args
+    )
+
+
+def get(url: str, target: str = 'other', **kwargs) -> requests.Response:
+    """Makes a GET request timed as a call to the `target` in metrics."""
+
+    kwargs.setdefault('timeout', timeout())
+    with metrics.timer('relay_outbound_duration_seconds', target=target):
+        return session().get(url, **kwargs)
+
+
+def post(url: str, target: str = 'other', **kwargs) -> requests.Response:
+    """Makes a POST request timed as a call to the `target` in metrics."""
+
+    kwargs.setdefault('timeout', timeout())
+    with metrics.timer('relay_outbound_duration_seconds', target=target):
+        return session().post(url, **kwargs)
+
+
+def pool_stats() -> Dict[str, int]:
+    """Returns usage statistics of the connection pools added up over all
+    the hosts, which are left out since they include other tenants' ones.
+
+    The statistics cover only the current worker process.
+    """
+
+    stats = dict.fromkeys(['pools', 'maxsize', 'in_use', 'idle',
+                           'connections', 'requests'], 0)
+    if _session is None:
+        return stats
+
+    adapters = {id(adapter): adapter for adapter in _session.adapters.values()}
+
+    for adapter in adapters.values():
+        pools = adapter.poolmanager.pools
+
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None or pool.pool is None:
+                continue
+
+            queue = list(pool.pool.queue)
+            stats['pools'] += 1
+            stats['maxsize'] += pool.pool.maxsize
+            stats['in_use'] += pool.pool.maxsize - len(queue)
+            stats['idle'] += sum(1 for conn in queue if conn is not None)
+            stats['connections'] += pool.num_connections
+            stats['requests'] += pool.num_requests
+
+    return stats
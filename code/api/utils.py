@@ -1,12 +1,38 @@
 import jwt
 import json
+import time
+import codecs
+import contextvars
+import threading
+import traceback
+from collections import OrderedDict, defaultdict
 from json.decoder import JSONDecodeError
-import requests
-
-from typing import Any
-from flask import request, current_app, jsonify, g
-from requests.exceptions import ConnectionError, InvalidURL, HTTPError
-from api.errors import InvalidArgumentError, AuthorizationError
+from itertools import chain
+from tempfile import SpooledTemporaryFile
+
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+from flask import (
+    request,
+    current_app,
+    jsonify,
+    g,
+    json as flask_json,
+    Response,
+    stream_with_context
+)
+from requests.exceptions import (
+    ConnectionError,
+    InvalidURL,
+    HTTPError,
+    Timeout
+)
+from api import metrics, profiling, sessions
+from api.errors import (
+    InvalidArgumentError,
+    AuthorizationError,
+    TRFormattedError
+)
 from jwt import InvalidSignatureError, InvalidAudienceError, DecodeError
 
 NO_AUTH_HEADER = 'Authorization header is missing'
@@ -33,25 +59,143 @@ def set_env_variable(payload, key):
     current_app.config[key] = env_variable
 
 
+# Public keys per JWKS host as `(fetched_at, {kid: key})` pairs, shared by
+# all threads of a worker process, the least recently used host first.
+# Fetch locks are dropped along with the keys or once a fetch fails.
+_public_keys = OrderedDict()
+_public_keys_locks = defaultdict(threading.Lock)
+_public_keys_lock = threading.Lock()
+_public_keys_revalidating = set()
+
+
+def fetch_public_keys(jwks_host) -> Dict[str, Any]:
+    """Fetches the public keys published by the JWKS host."""
+
+    response = sessions.get(f"https://{jwks_host}/.well-known/jwks", 'jwks')
+    response.raise_for_status()
+    jwks = response.json()
+
+    public_keys = {}
+    for jwk in jwks['keys']:
+        kid = jwk['kid']
+        public_keys[kid] = jwt.algorithms.RSAAlgorithm.from_jwk(
+            json.dumps(jwk)
+        )
+    return public_keys
+
+
+def refresh_public_keys(jwks_host, min_age=0) -> Dict[str, Any]:
+    """Refetches the public keys of the JWKS host.
+
+    Only one thread at a time fetches the keys of a host. The keys are not
+    refetched if they are younger than `min_age` seconds, which is the case
+    when a concurrent thread has just refreshed them.
+    """
+
+    with _public_keys_lock:
+        lock = _public_keys_locks[jwks_host]
+
+    with lock:
+        entry = _public_keys.get(jwks_host)
+        if entry is not None and time.monotonic() - entry[0] < min_age:
+            return entry[1]
+
+        try:
+            public_keys = fetch_public_keys(jwks_host)
+        except Exception:
+            with _public_keys_lock:
+                if _public_keys_locks.get(jwks_host) is lock:
+                    del _public_keys_locks[jwks_host]
+            raise
+
+        store_public_keys(jwks_host, public_keys)
+        return public_keys
+
+
+def store_public_keys(jwks_host, public_keys):
+    """Caches the public keys of the JWKS host, evicting the keys of the
+    least recently used hosts beyond `JWKS_CACHE_MAX_HOSTS`."""
+
+    max_hosts = current_app.config['JWKS_CACHE_MAX_HOSTS']
+
+    with _public_keys_lock:
+        _public_keys[jwks_host] = (time.monotonic(), public_keys)
+        _public_keys.move_to_end(jwks_host)
+
+        while len(_public_keys) > max_hosts:
+            host, _ = _public_keys.popitem(last=False)
+            _public_keys_locks.pop(host, None)
+
+
+def revalidate_public_keys(jwks_host, min_age):
+    """Refreshes the public keys of the JWKS host in the background."""
+
+    with _public_keys_lock:
+        if jwks_host in _public_keys_revalidating:
+            return
+        _public_keys_revalidating.add(jwks_host)
+
+    app = current_app._get_current_object()
+
+    def revalidate():
+        try:
+            with app.app_context():
+                refresh_public_keys(jwks_host, min_age)
+        except Exception:
+            app.logger.warning(
+                f'Failed to refresh public keys of {jwks_host}',
+                exc_info=True
+            )
+        finally:
+            with _public_keys_lock:
+                _public_keys_revalidating.discard(jwks_host)
+
+    threading.Thread(target=revalidate, daemon=True).start()
+
+
+def cached_public_keys(jwks_host) -> Dict[str, Any]:
+    """Returns the public keys of the JWKS host, fetching them if needed."""
+
+    ttl = current_app.config['JWKS_CACHE_TTL']
+    stale_ttl = current_app.config['JWKS_CACHE_STALE_TTL']
+
+    with _public_keys_lock:
+        entry = _public_keys.get(jwks_host)
+        if entry is not None:
+            _public_keys.move_to_end(jwks_host)
+
+    if entry is not None:
+        fetched_at, public_keys = entry
+        age = time.monotonic() - fetched_at
+
+        if age < ttl:
+            return public_keys
+        if age < ttl + stale_ttl:
+            revalidate_public_keys(jwks_host, ttl)
+            return public_keys
+
+    return refresh_public_keys(jwks_host, ttl)
+
+
 def get_public_key(jwks_host, token):
     expected_errors = (
         ConnectionError,
         InvalidURL,
         JSONDecodeError,
         HTTPError,
+        Timeout,
     )
     try:
-        response = requests.get(f"https://{jwks_host}/.well-known/jwks")
-        response.raise_for_status()
-        jwks = response.json()
-
-        public_keys = {}
-        for jwk in jwks['keys']:
-            kid = jwk['kid']
-            public_keys[kid] = jwt.algorithms.RSAAlgorithm.from_jwk(
-                json.dumps(jwk)
-            )
+        public_keys = cached_public_keys(jwks_host)
         kid = jwt.get_unverified_header(token)['kid']
+
+        # The keys may have been rotated since they were cached.
+        if kid not in public_keys:
+            public_keys = refresh_public_keys(
+                jwks_host,
+                current_app.config['JWKS_CACHE_MIN_REFRESH_INTERVAL']
+            )
+
         return public_keys.get(kid)
 
     except expected_errors:
@@ -75,14 +219,16 @@ def get_credentials():
 
     token = get_auth_token()
     try:
-        jwks_host = jwt.decode(
-            token, options={'verify_signature': False}
-        )['jwks_host']
-        key = get_public_key(jwks_host, token)
-        aud = request.url_root
-        payload = jwt.decode(
-            token, key=key, algorithms=['RS256'], audience=[aud.rstrip('/')]
-        )
+        with metrics.timer('relay_jwt_verification_seconds'):
+            jwks_host = jwt.decode(
+                token, options={'verify_signature': False}
+            )['jwks_host']
+            key = get_public_key(jwks_host, token)
+            aud = request.url_root
+            payload = jwt.decode(
+                token, key=key, algorithms=['RS256'],
+                audience=[aud.rstrip('/')]
+            )
         set_env_variable(payload, 'API_URL')
         set_env_variable(payload, 'PLATFORM_URL')
         set_env_variable(payload, 'CTR_ENTITIES_LIMIT')
@@ -162,13 +308,192 @@ def jsonify_result():
         if not result.get('data'):
             result.pop('data', None)
 
-    return jsonify(result)
+    with metrics.timer('relay_serialization_seconds'):
+        return jsonify(result)
+
+
+def stream_result(results: Iterable[Dict[str, List[Any]]]) -> Response:
+    """Streams the same response `jsonify_result` makes out of `g`.
+
+    Each item of `results` holds the sightings, indicators, etc. of a single
+    observable. Indicators are written out as soon as they are received,
+    the other entities are spooled (to disk once they outgrow the memory
+    budget) until all the indicators are written, so that memory stays
+    bounded. The counts are written after the documents. Errors raised while
+    iterating stop the iteration and get into `errors` like they do with
+    `jsonify_result`.
+    """
+
+    kinds = ['indicators', 'judgements', 'relationships', 'sightings']
+    spool_size = current_app.config['OBSERVE_STREAMING_SPOOL_SIZE']
+    chunk_size = current_app.config['OBSERVE_STREAMING_CHUNK_SIZE']
+
+    def generate() -> Iterator[str]:
+        counts = dict.fromkeys(kinds, 0)
+        spools = {kind: SpooledTemporaryFile(spool_size, mode='w+')
+                  for kind in kinds[1:]}
+
+        written = []
+
+        def section(kind):
+            prefix = ', ' if written else '{"data": {'
+            written.append(kind)
+            return f'{prefix}{flask_json.dumps(kind)}: {{"docs": ['
+
+        try:
+            try:
+                for result in results:
+                    for doc in result.get(kinds[0]) or []:
+                        yield (', ' if counts[kinds[0]] else section(kinds[0]))
+                        yield flask_json.dumps(doc)
+                        counts[kinds[0]] += 1
+
+                    for kind in kinds[1:]:
+                        for doc in result.get(kind) or []:
+                            if counts[kind]:
+                                spools[kind].write(', ')
+                            spools[kind].write(flask_json.dumps(doc))
+                            counts[kind] += 1
+            except TRFormattedError as error:
+                current_app.logger.error(traceback.format_exc())
+                add_error(error)
+
+            if counts[kinds[0]]:
+                yield f'], "count": {counts[kinds[0]]}}}'
+
+            for kind in kinds[1:]:
+                if not counts[kind]:
+                    continue
+
+                yield section(kind)
+
+                spools[kind].seek(0)
+                for chunk in iter(lambda: spools[kind].read(chunk_size), ''):
+                    yield chunk
+
+                yield f'], "count": {counts[kind]}}}'
+
+            errors = g.get('errors')
+
+            if written:
+                yield '}'
+            elif errors:
+                yield '{'
+            else:
+                yield '{"data": {}'
+
+            if errors:
+                yield ', ' if written else ''
+                yield f'"errors": {flask_json.dumps(errors)}'
+
+            yield '}'
+        finally:
+            for spool in spools.values():
+                spool.close()
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/json')
 
 
 def add_error(error):
+    metrics.inc('relay_errors_total', code=error.code)
     g.errors = [*g.get('errors', []), error.json]
 
 
+def submitter(executor: Executor) -> Callable[..., Future]:
+    """Returns `executor.submit` running tasks in the current app context
+    and with the current context variables."""
+
+    app = current_app._get_current_object()
+
+    def submit(fn, *args, **kwargs):
+        def run():
+            with app.app_context(), profiling.thread():
+                return fn(*args, **kwargs)
+
+        # Let the task see the context variables, e.g. the deadline.
+        return executor.submit(contextvars.copy_context().run, run)
+
+    return submit
+
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Incrementally parses a JSON array from chunks of UTF-8 bytes.
+
+    The items are yielded one by one as soon as they are complete, so neither
+    the whole body nor the whole array is ever held in memory. The array is
+    parsed as strictly as `json.loads` does, raising `JSONDecodeError` on
+    anything else, e.g. missing commas or data after the closing bracket,
+    once the parsing gets there.
+    """
+
+    decoder = json.JSONDecoder()
+    decode = codecs.getincrementaldecoder('utf-8')().decode
+    chunks = chain((decode(chunk) for chunk in chunks), [decode(b'', True)])
+
+    buffer, index = '', 0
+    # What is expected next: the opening bracket, the first item (or the
+    # closing bracket), an item after a comma, a comma (or the closing
+    # bracket), or nothing but whitespace after the array.
+    expected = 'array'
+    exhausted = False
+
+    while True:
+        while index < len(buffer) and buffer[index] in ' \t\n\r':
+            index += 1
+
+        if index < len(buffer):
+            char = buffer[index]
+
+            if expected == 'array':
+                if char != '[':
+                    raise JSONDecodeError('Expecting array', buffer, index)
+                expected, index = 'first', index + 1
+                continue
+
+            if expected == 'end':
+                raise JSONDecodeError('Extra data', buffer, index)
+
+            if expected in ('first', 'comma') and char == ']':
+                expected, index = 'end', index + 1
+                continue
+
+            if expected == 'comma':
+                if char != ',':
+                    raise JSONDecodeError("Expecting ',' delimiter",
+                                          buffer, index)
+                expected, index = 'item', index + 1
+                continue
+
+            if char in ',]':
+                raise JSONDecodeError('Expecting value', buffer, index)
+
+            try:
+                item, end = decoder.raw_decode(buffer, index)
+            except JSONDecodeError:
+                if exhausted:
+                    raise
+            else:
+                # A number could still go on in the next chunk, e.g. '-1.'
+                # parsed as -1 could be the start of '-1.5'.
+                if exhausted or (end < len(buffer)
+                                 and buffer[end] not in '0123456789+-.eE'):
+                    yield item
+                    expected, index = 'comma', end
+                    continue
+
+        if exhausted:
+            if expected == 'end':
+                return
+            raise JSONDecodeError('Unexpected end of array', buffer, index)
+
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+        else:
+            buffer, index = buffer[index:] + chunk, 0
+
+
 def url_join(base, *parts):
     return '/'.join(
         [base.rstrip('/')] +
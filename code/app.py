@@ -1,18 +1,24 @@
 import traceback
+from importlib import import_module
 
 from flask import Flask, jsonify
 
-from api import health, enrich, version, watchdog
+from api import health, enrich, metrics, profiling, version, watchdog
 from api.errors import TRFormattedError
 from api.utils import add_error, jsonify_result
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
 
+for plugin in app.config['OBSERVABLE_PLUGINS']:
+    import_module(plugin)
+
 app.register_blueprint(health.api)
 app.register_blueprint(enrich.api)
 app.register_blueprint(version.api)
 app.register_blueprint(watchdog.api)
+app.register_blueprint(metrics.api)
+app.register_blueprint(profiling.api)
 
 
 @app.errorhandler(TRFormattedError)
@@ -34,6 +40,8 @@ def handle_error(exception):
     if code != 404:
         app.logger.error(traceback.format_exc())
 
+    metrics.inc('relay_errors_total', code=str(code))
+
     response = jsonify(code=code, message=message, reason=reason)
     return response, code
 
@@ -0,0 +1,106 @@
+"""Compares the precompiled field accessors with splitting paths on every
+lookup, both for single lookups and for reading all the fields the CTIM
+mapping needs from an event (now made into an `Event` first).
+
+Run from the `code` folder with `python -m benchmarks.accessors`.
+"""
+
+import timeit
+
+from app import app
+from api.events import Event, accessor, get
+from api.observables import read
+from benchmarks.corpus import events
+
+ID = accessor('.id')
+DATE_TIME = accessor('.dateTime')
+FULL_OS_NAME = accessor('.asset.fullOSName')
+REMOTE_DNS = accessor('.network.remoteDns')
+
+
+def split_get(event, path, default=None):
+    """Returns a value by a path the way it was done before compiling."""
+
+    result = event
+    parts = iter(path.split('.'))
+    next(parts)
+
+    for part in parts:
+        if part in result:
+            result = result[part]
+        else:
+            return default
+
+    return result
+
+
+RELATION_PATHS = [
+    ('.file.fileName', '.file.sha256'),
+    ('.file.fileName', '.file.md5'),
+    ('.file.fullPath', '.file.sha256'),
+    ('.file.fullPath', '.file.md5'),
+    ('.process.processName', '.network.remoteIP'),
+    ('.process.processName', '.network.remoteDns'),
+    ('.network.remoteIP', '.network.remoteDns'),
+]
+
+
+def split_read(event):
+    """Reads the fields the mapping used to read, one lookup per use."""
+
+    judgements = split_get(event, '.indicator2') or []
+
+    for _ in range(2 + len(judgements)):
+        split_get(event, '.id')
+        split_get(event, '.score')
+    for _ in range(4):
+        split_get(event, '.dateTime')
+    split_get(event, '.asset.fullOSName')
+
+    for source, target in RELATION_PATHS:
+        split_get(event, source)
+        split_get(event, target)
+
+    split_get(event, '.asset.netBiosName')
+    split_get(event, '.asset.interfaces')
+
+
+def run(number=20):
+    corpus = events(1000)
+    path = app.config['QUALYS_EVENT_STATE_PATH']
+
+    def lookups(get_):
+        for event in corpus:
+            get_(event, '.id')
+            get_(event, '.dateTime')
+            get_(event, '.asset.fullOSName')
+            get_(event, '.network.remoteDns')
+
+    def reads(read_):
+        for event in corpus:
+            read_(event)
+
+    def accessors():
+        for event in corpus:
+            ID(event)
+            DATE_TIME(event)
+            FULL_OS_NAME(event)
+            REMOTE_DNS(event)
+
+    results = [
+        ('lookup, split', lambda: lookups(split_get)),
+        ('lookup, get', lambda: lookups(get)),
+        ('lookup, accessor', accessors),
+        ('event, split', lambda: reads(split_read)),
+        ('event, compiled', lambda: reads(lambda e: read(Event.of(e, path)))),
+    ]
+
+    print(f'{"benchmark":<20}{"usec per event":>16}')
+    for name, fn in results:
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        print(f'{name:<20}{seconds / len(corpus) * 1e6:>16.2f}')
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        run()
@@ -0,0 +1,103 @@
+"""Measures what building CTIM documents costs with and without the
+recursive `clean` pass that used to drop `None` values from every document.
+
+Run from the `code` folder with `python -m benchmarks.builders`.
+"""
+
+import timeit
+import tracemalloc
+
+from app import app
+from api.events import Event
+from api.observables import MD5, read
+from benchmarks.corpus import events
+
+
+def clean(data):
+    """Recursively cleans a `dict` or a `list` from 'None' values."""
+
+    if isinstance(data, list):
+        return [x for x in map(clean, data) if x is not None]
+
+    if isinstance(data, dict):
+        result = {key: clean(value) for key, value in data.items()}
+        result = {key: value for key, value in result.items()
+                  if value is not None}
+
+        return result
+
+    return data
+
+
+def containers(data):
+    """Counts the dicts and lists `clean` allocates copying the data."""
+
+    if isinstance(data, list):
+        return 1 + sum(map(containers, data))
+    if isinstance(data, dict):
+        return 2 + sum(map(containers, data.values()))
+    return 0
+
+
+def judgements(observable, fields, value):
+    """Builds all the judgements of an event."""
+    return [observable._judgement(fields, value, index)
+            for index in range(len(fields['indicator2']))]
+
+
+def build(fields, wrap):
+    observable = MD5()
+    value = 'd41d8cd98f00b204e9800998ecf8427e'
+
+    docs = [wrap(observable._sighting(fields, value, True))]
+    if fields['score'] is not None:
+        docs.append(wrap(observable._indicator(fields)))
+    docs.extend(map(wrap, judgements(observable, fields, value)))
+
+    return docs
+
+
+def run(number=5):
+    corpus = [
+        *events(500, interfaces=3, verdicts=3),
+        *events(500, interfaces=1, verdicts=1, dense=False),
+    ]
+    # Sparse events with missing values exercise the dropped fields.
+    for event in corpus[::10]:
+        event['asset']['fullOSName'] = None
+        event['indicator2'][0]['threatName'] = None
+
+    fields = [read(event) for event in Event.parse(corpus)]
+
+    def plain():
+        return [build(fields_, lambda doc: doc) for fields_ in fields]
+
+    def cleaned():
+        return [build(fields_, clean) for fields_ in fields]
+
+    # Both ways must produce the same documents.
+    for docs, cleaned_docs in zip(plain(), cleaned()):
+        for doc, cleaned_doc in zip(docs, cleaned_docs):
+            doc.pop('id'), cleaned_doc.pop('id')
+            assert doc == cleaned_doc
+
+    copies = sum(containers(doc) for docs in plain() for doc in docs)
+
+    print(f'{len(corpus)} events, {copies} containers copied by clean')
+    print(f'{"builders":<12}{"ms per 1000 events":>20}{"peak KiB":>12}')
+
+    for name, fn in [('clean', cleaned), ('plain', plain)]:
+        seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f'{name:<12}{seconds / len(corpus) * 1e6:>20.1f}'
+              f'{peak / 1024:>12.0f}')
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        run()
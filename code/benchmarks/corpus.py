@@ -0,0 +1,56 @@
+import random
+from typing import Any, Dict, List
+
+VERDICTS = ['KNOWN', 'UNKNOWN', 'SUSPICIOUS', 'MALICIOUS', 'REMEDIATED']
+
+
+def event(index: int, interfaces: int = 2, verdicts: int = 2,
+          dense: bool = True, rng: random.Random = None) -> Dict[str, Any]:
+    """Returns a synthetic Qualys IOC event of a realistic shape.
+
+    A dense event has file, process and network details, a sparse one
+    has only the fields every event has.
+    """
+
+    rng = rng or random.Random(index)
+
+    result = {
+        'id': f'{index:08d}-{rng.getrandbits(64):016x}',
+        'dateTime': f'2021-03-{1 + index % 28:02d}T10:00:00.000+0000',
+        'score': str(rng.randrange(11)),
+        'asset': {
+            'netBiosName': f'HOST-{index % 97}',
+            'fullOSName': 'Microsoft Windows 10 Pro 10.0.18363 64-bit',
+            'interfaces': [
+                {'ipAddress': f'10.0.{i}.{index % 250}',
+                 'macAddress': f'00:50:56:{i:02x}:{index % 256:02x}:01'}
+                for i in range(interfaces)
+            ],
+        },
+        'indicator2': [
+            {'verdict': rng.choice(VERDICTS),
+             'threatName': f'Threat.{index % 13}.{i}'}
+            for i in range(verdicts)
+        ],
+    }
+
+    if dense:
+        result.update({
+            'file': {
+                'fileName': f'sample{index % 31}.exe',
+                'fullPath': f'C:\\Users\\user\\sample{index % 31}.exe',
+                'md5': f'{rng.getrandbits(128):032x}',
+                'sha256': f'{rng.getrandbits(256):064x}',
+            },
+            'process': {'processName': 'explorer.exe'},
+            'network': {'localIP': f'192.0.2.{index % 250}',
+                        'remoteIP': f'203.0.113.{index % 250}',
+                        'remoteDns': f'host{index % 50}.example.com'},
+        })
+
+    return result
+
+
+def events(count: int, **kwargs) -> List[Dict[str, Any]]:
+    """Returns a reproducible list of synthetic events."""
+    return [event(index, **kwargs) for index in range(count)]
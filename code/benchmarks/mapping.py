@@ -0,0 +1,197 @@
+"""Benchmarks each stage of mapping Qualys events to CTIM, as well as the
+whole `Observable.observe`, on synthetic corpora of different shapes.
+
+Reports events per second and the memory blocks allocated (and kept) per
+event. Results can be saved as a named baseline and compared against one,
+e.g. before and after a change:
+
+    python -m benchmarks.mapping --save before
+    python -m benchmarks.mapping --compare before
+
+Baselines are kept out of the source tree, in the temporary folder unless
+another one is given with `--baselines`. Run from the `code` folder.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from app import app
+from api.events import Event
+from api.observables import MD5, read, relations, severity, targets
+from benchmarks.corpus import events
+
+BASELINES = os.path.join(tempfile.gettempdir(),
+                         'tr-qualys-ioc-benchmarks')
+
+VALUE = 'd41d8cd98f00b204e9800998ecf8427e'
+
+
+def corpora(count: int) -> Dict[str, List[Dict[str, Any]]]:
+    sparse = events(count, interfaces=1, verdicts=1, dense=False)
+    # Sparse events miss some of the values the mapping reads.
+    for event in sparse[::3]:
+        event['asset']['fullOSName'] = None
+        event['indicator2'][0]['threatName'] = None
+        event['score'] = None
+
+    return {
+        'dense': events(count, interfaces=2, verdicts=2),
+        'wide': events(count, interfaces=16, verdicts=12),
+        'sparse': sparse,
+    }
+
+
+def stages(corpus: List[Dict[str, Any]]) -> Dict[str, Callable[[], Any]]:
+    """Returns a function per stage mapping the whole corpus.
+
+    The stages past building single documents are the ones `observe` runs:
+    `plan` works out the IDs of the objects to build, and `map` builds them
+    along with the relationships between them.
+    """
+
+    observable = MD5()
+    parsed = Event.parse(corpus)
+    fields = [read(event) for event in parsed]
+    paired = [(True, event) for event in parsed]
+    limit = len(corpus)
+
+    def search(active, amount):
+        return parsed[:amount]
+
+    return {
+        'parse': lambda: Event.parse(corpus),
+        'read': lambda: [read(event) for event in parsed],
+        'relations': lambda: [list(relations(event)) for event in parsed],
+        'targets': lambda: [list(targets(event)) for event in parsed],
+        'severity': lambda: [severity(event) for event in parsed],
+        'sighting': lambda: [observable._sighting(fields_, VALUE, True)
+                             for fields_ in fields],
+        'indicator': lambda: [observable._indicator(fields_)
+                              for fields_ in fields
+                              if fields_['score'] is not None],
+        'plan': lambda: list(observable.plan(VALUE, paired, limit, set())),
+        'map': lambda: observable.map(VALUE, paired, limit, set()),
+        'observe': lambda: observable.observe(VALUE, limit, {}, search),
+    }
+
+
+def measure(fn: Callable[[], Any], count: int,
+            number: int) -> Dict[str, float]:
+    seconds = min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+    # Blocks still allocated after the run are the ones the result holds.
+    gc.collect()
+    before = sys.getallocatedblocks()
+    result = fn()
+    blocks = sys.getallocatedblocks() - before
+    del result
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'events_per_sec': round(count / seconds),
+        'blocks_per_event': round(blocks / count, 1),
+        'peak_bytes_per_event': round(peak / count),
+    }
+
+
+def run(count: int, number: int, only: List[str]) -> Dict[str, Any]:
+    results = {}
+
+    for corpus_name, corpus in corpora(count).items():
+        for stage, fn in stages(corpus).items():
+            name = f'{corpus_name}/{stage}'
+            if only and not any(part in name for part in only):
+                continue
+
+            results[name] = measure(fn, len(corpus), number)
+
+    return results
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True, cwd=os.path.dirname(__file__)
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(results: Dict[str, Any], baseline: Dict[str, Any] = None):
+    columns = ['events_per_sec', 'blocks_per_event', 'peak_bytes_per_event']
+    headers = ['events/s', 'blocks/event', 'peak B/event']
+
+    print(f'{"corpus/stage":<24}'
+          + ''.join(f'{header:>14}' for header in headers)
+          + (f'{"events/s vs":>14}' if baseline else ''))
+
+    for name, result in results.items():
+        line = f'{name:<24}' + ''.join(f'{result[c]:>14}' for c in columns)
+
+        base = (baseline or {}).get(name)
+        if base:
+            change = result['events_per_sec'] / base['events_per_sec'] - 1
+            line += f'{change:>+14.1%}'
+
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.mapping',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--events', type=int, default=1000,
+                        help='events per corpus')
+    parser.add_argument('--number', type=int, default=3,
+                        help='runs per measurement')
+    parser.add_argument('--only', action='append', default=[],
+                        help='run the benchmarks with names containing it')
+    parser.add_argument('--save', metavar='NAME',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='NAME',
+                        help='compare the results with a baseline')
+    parser.add_argument('--baselines', metavar='PATH', default=BASELINES,
+                        help='the folder the baselines are kept in '
+                             '(default: %(default)s)')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(args.baselines,
+                               f'{args.compare}.json')) as file:
+            saved = json.load(file)
+        print(f'Comparing with {args.compare!r} '
+              f'(revision {saved["revision"]}, Python {saved["python"]})')
+        baseline = saved['results']
+
+    app.config['API_URL'] = 'https://qualys.invalid'
+    with app.app_context():
+        results = run(args.events, args.number, args.only)
+
+    report(results, baseline)
+
+    if args.save:
+        os.makedirs(args.baselines, exist_ok=True)
+        with open(os.path.join(args.baselines, f'{args.save}.json'),
+                  'w') as file:
+            json.dump({'revision': revision(),
+                       'python': platform.python_version(),
+                       'events': args.events,
+                       'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Measures mapping events found for several overlapping observables with
+the objects shared by all of them (one `seen` set per request) and with
+every observable mapped on its own, as it was before the objects got
+content-addressed IDs.
+
+Only the objects returned are built, so the indicators shared by the
+observables are built once instead of once per observable. The time of
+the mapping itself hardly changes though, as working out the IDs of the
+objects costs more than building the few skipped ones. What is saved is
+the repeated objects in the response, i.e. fewer documents and a smaller
+payload to serialise and send.
+
+Run from the `code` folder with `python -m benchmarks.overlap`.
+"""
+
+import json
+import timeit
+
+from app import app
+from api.events import Event, get
+from api.observables import Observable
+from benchmarks.corpus import events
+
+# Each of the observables is found in every event of the corpus.
+PATHS = {
+    'md5': '.file.md5',
+    'sha256': '.file.sha256',
+    'file_name': '.file.fileName',
+    'file_path': '.file.fullPath',
+    'domain': '.network.remoteDns',
+}
+
+
+def observe(corpus, limit, shared):
+    seen = set() if shared else None
+    data = {}
+
+    for type_, path in PATHS.items():
+        observable = Observable.of(type_)
+        value = get(corpus[0], path)
+
+        def search(active, amount):
+            return corpus[:amount] if not active else []
+
+        observed = observable.observe(value, limit, {}, search, seen)
+        for kind, docs in observed.items():
+            data.setdefault(kind, []).extend(docs)
+
+    return data
+
+
+def run(limit=100, number=5):
+    app.config['API_URL'] = 'https://qualys.invalid'
+    corpus = Event.parse(events(limit, interfaces=2, verdicts=2))
+
+    print(f'{len(PATHS)} observables sharing {limit} events')
+    print(f'{"objects":<12}{"indicators":>12}{"docs":>8}{"map ms":>10}'
+          f'{"dump ms":>10}{"payload KiB":>14}')
+
+    def best(fn):
+        return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+    for name, shared in [('separate', False), ('shared', True)]:
+        data = observe(corpus, limit, shared)
+        docs = sum(map(len, data.values()))
+        payload = json.dumps(data)
+
+        mapping = best(lambda: observe(corpus, limit, shared))
+        dumping = best(lambda: json.dumps(data))
+
+        print(f'{name:<12}{len(data["indicators"]):>12}{docs:>8}'
+              f'{mapping * 1e3:>10.1f}{dumping * 1e3:>10.1f}'
+              f'{len(payload) / 1024:>14.0f}')
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        run()
@@ -1,5 +1,6 @@
 import os
 import json
+import tempfile
 
 from uuid import NAMESPACE_X500
 
@@ -14,4 +15,143 @@ class Config:
     PLATFORM_URL_DEFAULT = ''
     CTR_ENTITIES_LIMIT_DEFAULT = 100
 
+    # Public keys fetched from `/.well-known/jwks` are shared by all requests
+    # of a worker process. Fresh keys are used as is, stale ones are still
+    # served while being refreshed in the background, expired ones are
+    # refetched synchronously. An unknown `kid` forces a refetch at most once
+    # per the specified interval. All values are in seconds. The hosts come
+    # from tokens not verified yet, so only the keys of the specified number
+    # of the most recently used hosts are kept.
+    JWKS_CACHE_TTL = 60 * 60
+    JWKS_CACHE_STALE_TTL = 24 * 60 * 60
+    JWKS_CACHE_MIN_REFRESH_INTERVAL = 30
+    JWKS_CACHE_MAX_HOSTS = 32
+
+    # Qualys tokens are shared by all requests of a worker process made with
+    # the same API URL and credentials. The lifetime is taken from the token
+    # itself when possible and is capped by the TTL. A token is refreshed the
+    # specified margin before it expires. All values are in seconds. Only the
+    # tokens of the specified number of the most recently used API URLs and
+    # credentials are kept.
+    QUALYS_TOKEN_TTL = 4 * 60 * 60
+    QUALYS_TOKEN_REFRESH_MARGIN = 5 * 60
+    QUALYS_TOKEN_CACHE_MAX_KEYS = 256
+
+    # Outbound requests share keep-alive connection pools per worker process.
+    # POOL_CONNECTIONS is the number of hosts to keep pools for, POOL_MAXSIZE
+    # is the number of connections kept per host, which should cover uWSGI
+    # threads times OBSERVE_CONCURRENCY. Timeouts are in seconds.
+    HTTP_POOL_CONNECTIONS = 10
+    HTTP_POOL_MAXSIZE = 10
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 30
+
+    # The maximum number of Qualys searches run in parallel per request.
+    OBSERVE_CONCURRENCY = 5
+
+    # The time budget in seconds for the Qualys calls of a single observe
+    # request (zero turns it off). Once it is spent, the entities found so
+    # far are returned along with a warning.
+    OBSERVE_DEADLINE = 20
+
+    # Search for the active and inactive events of an observable at once and
+    # tell them apart by the boolean at the specified path of each event.
+    # The active events are still searched separately if the single search
+    # finds as many events as the limit and some of them are inactive, since
+    # more active events may follow. Once the events of an API URL turn out
+    # to have no such field, separate searches are always made instead.
+    QUALYS_SINGLE_QUERY = True
+    QUALYS_EVENT_STATE_PATH = '.state'
+
+    # Observables of the same type are searched in batches of up to
+    # BATCH_SIZE observables with a combined filter of up to
+    # BATCH_FILTER_LENGTH URL-encoded characters. The combined result is
+    # read in pages of PAGE_SIZE events, up to BATCH_MAX_PAGES pages.
+    QUALYS_PAGE_SIZE = 100
+    QUALYS_BATCH_SIZE = 20
+    QUALYS_BATCH_FILTER_LENGTH = 2000
+    QUALYS_BATCH_MAX_PAGES = 5
+
+    # Searches for more than PAGE_SIZE events are made page by page. Once the
+    # first page comes out full, up to PAGE_CONCURRENCY of the pages needed
+    # to reach the entities limit are requested at once (1 requests them one
+    # after another), at the cost of requesting pages past the last one.
+    QUALYS_PAGE_CONCURRENCY = 3
+
+    # Searches answered with 429 or 503 are retried up to RETRIES times after
+    # the Retry-After delay or, without one, a random delay of up to
+    # RETRY_BACKOFF * 2 ** attempt seconds. No retry waits for longer than
+    # RETRY_MAX_DELAY seconds or past the request deadline.
+    QUALYS_RETRIES = 2
+    QUALYS_RETRY_BACKOFF = 0.5
+    QUALYS_RETRY_MAX_DELAY = 10
+
+    # Qualys searches can be limited to RATE_LIMIT per second per API URL
+    # and user, with bursts of up to RATE_BURST searches, e.g. to stay within
+    # the API quota of a Qualys subscription. The limit is off by default
+    # (zero). Searches over the limit wait for their turn as long as the
+    # request deadline allows, except for the health check. The limits are
+    # shared by worker processes through the files in RATE_LIMIT_PATH.
+    QUALYS_RATE_LIMIT = 0
+    QUALYS_RATE_BURST = 20
+    QUALYS_RATE_LIMIT_PATH = os.path.join(tempfile.gettempdir(),
+                                          'tr-qualys-ioc-limits')
+
+    # After BREAKER_THRESHOLD failed calls in a row (connection errors,
+    # timeouts and 5xx responses), calls to the API URL fail fast for
+    # BREAKER_RESET seconds. Then a single probe call decides whether
+    # to resume the calls or to fail fast again.
+    QUALYS_BREAKER_THRESHOLD = 5
+    QUALYS_BREAKER_RESET = 30
+
+    # Parse found events one by one while reading them from Qualys in chunks
+    # of the specified number of bytes, rather than reading the whole body
+    # first, and stop reading once the requested number of events is parsed.
+    QUALYS_STREAM_PARSING = True
+    QUALYS_STREAM_CHUNK = 64 * 1024
+
+    # Metrics of each worker process are written to a file in METRICS_PATH
+    # once a request is served, and at most once per FLUSH_INTERVAL seconds
+    # while it is being served, so that /metrics can add up the metrics of
+    # all the worker processes.
+    METRICS_PATH = os.path.join(tempfile.gettempdir(), 'tr-qualys-ioc-metrics')
+    METRICS_FLUSH_INTERVAL = 1
+
+    # Requests are profiled if PROFILE_REQUESTS is on, or if they carry the
+    # PROFILE_HEADER set to PROFILE_TOKEN (the header is ignored while there
+    # is no token). The call stacks of a profiled request are sampled every
+    # PROFILE_INTERVAL seconds and written to a file in PROFILE_PATH in the
+    # collapsed format (e.g. for speedscope or flamegraph.pl), and the time
+    # spent in each phase is returned in the Server-Timing header.
+    PROFILE_REQUESTS = False
+    PROFILE_HEADER = 'X-Relay-Profile'
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+    PROFILE_INTERVAL = 0.005
+    PROFILE_PATH = os.path.join(tempfile.gettempdir(),
+                                'tr-qualys-ioc-profiles')
+
+    # Found events are cached per tenant for the TTL in seconds (zero turns
+    # the cache off). The in-process cache keeps up to MAX_EVENTS events and
+    # evicts the least recently used searches. The 'uwsgi' backend shares
+    # the cache NAME configured in uwsgi.ini between worker processes.
+    QUALYS_CACHE_TTL = 5 * 60
+    QUALYS_CACHE_MAX_EVENTS = 20000
+    QUALYS_CACHE_BACKEND = os.environ.get('QUALYS_CACHE_BACKEND', 'memory')
+    QUALYS_CACHE_NAME = 'qualys'
+
+    # Stream the response of /observe/observables while it is being built.
+    # Entities waiting for their turn are kept in memory up to SPOOL_SIZE
+    # bytes per entity type and then moved to a temporary file.
+    OBSERVE_STREAMING = False
+    OBSERVE_STREAMING_SPOOL_SIZE = 1024 * 1024
+    OBSERVE_STREAMING_CHUNK_SIZE = 64 * 1024
+
     NAMESPACE_BASE = NAMESPACE_X500
+
+    # Comma-separated modules to import on start-up, which register handlers
+    # of extra observable types with `api.observables.register`.
+    OBSERVABLE_PLUGINS = [
+        module
+        for module in os.environ.get('OBSERVABLE_PLUGINS', '').split(',')
+        if module
+    ]
@@ -0,0 +1,6 @@
+"""An offline load-test harness for the relay.
+
+It runs a fake Qualys IOC API and a JWKS issuer locally, starts the relay
+against them and drives load at its endpoints. Run from the `code` folder
+with `python -m loadtest --help`.
+"""
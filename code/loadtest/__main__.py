@@ -0,0 +1,233 @@
+"""Drives load at the relay endpoints and reports the throughput and the
+p50/p95/p99 latency of each of them.
+
+A fake Qualys IOC API and a JWKS issuer are run in a separate process, and
+unless the `--url` of a running relay is given, the relay is started with
+the development server in another one.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Process, Queue
+from typing import Any, Dict, List
+
+import requests
+
+from loadtest import jwks, qualys
+
+ENDPOINTS = ['/health', '/refer/observables', '/observe/observables']
+
+VALUES = {
+    'md5': lambda rng: f'{rng.getrandbits(128):032x}',
+    'sha256': lambda rng: f'{rng.getrandbits(256):064x}',
+    'ip': lambda rng: f'198.51.{rng.randrange(256)}.{rng.randrange(256)}',
+    'domain': lambda rng: f'host{rng.randrange(10 ** 6)}.example.com',
+    'file_name': lambda rng: f'sample{rng.randrange(10 ** 6)}.exe',
+}
+
+
+def arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m loadtest',
+                                     description=__doc__)
+    parser.add_argument('--url', help='a running relay to test instead')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='KEY=VALUE',
+                        help='a setting of the started relay (JSON value)')
+    parser.add_argument('--endpoint', action='append', choices=ENDPOINTS,
+                        help='the endpoints to test (all by default)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds per endpoint')
+    parser.add_argument('--warmup', type=float, default=2,
+                        help='seconds per endpoint not measured')
+    parser.add_argument('--observables', type=int, default=10,
+                        help='observables per request')
+    parser.add_argument('--distinct', type=int, default=1000,
+                        help='distinct values per observable type')
+    parser.add_argument('--limit', type=int, default=100,
+                        help='CTR_ENTITIES_LIMIT')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Qualys latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02)
+    parser.add_argument('--page-size', type=int, default=100,
+                        help='the largest page Qualys serves')
+    parser.add_argument('--events', type=int, default=10,
+                        help='events Qualys finds per observable')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of 429 and 503 Qualys responses')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='a file to write the results to')
+    return parser.parse_args()
+
+
+def stubs(args: argparse.Namespace, directory: str, audience: str,
+          queue: Queue):
+    """Runs the fake Qualys API and the JWKS issuer until terminated."""
+
+    settings = qualys.Settings(args.latency, args.jitter, args.page_size,
+                               args.events, args.error_rate, args.seed)
+    server = qualys.serve(settings)
+    api = f'http://127.0.0.1:{server.server_port}'
+
+    issuer = jwks.Issuer(directory)
+    issuer.serve()
+
+    token = issuer.token({
+        'aud': audience,
+        'user': 'loadtest',
+        'pass': 'loadtest',
+        'API_URL': api,
+        'PLATFORM_URL': 'https://qualysguard.invalid',
+        'CTR_ENTITIES_LIMIT': args.limit,
+    })
+    queue.put((token, issuer.certificate))
+
+    threading.Event().wait()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f'The relay did not start on port {port}.')
+
+
+def payloads(args: argparse.Namespace) -> List[List[Dict[str, str]]]:
+    """Returns a reproducible set of request bodies."""
+
+    rng = random.Random(args.seed)
+    pool = [{'type': type_, 'value': value(rng)}
+            for type_, value in VALUES.items()
+            for _ in range(args.distinct)]
+
+    return [rng.sample(pool, min(args.observables, len(pool)))
+            for _ in range(1000)]
+
+
+def drive(url: str, token: str, bodies: List[Any], concurrency: int,
+          duration: float) -> Dict[str, Any]:
+    """Sends requests from `concurrency` threads for `duration` seconds."""
+
+    latencies, errors = [], []
+    lock = threading.Lock()
+    started_at = time.monotonic()
+    deadline = started_at + duration
+
+    def worker(index: int):
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {token}'
+        rng = random.Random(index)
+
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.post(url, json=rng.choice(bodies),
+                                        timeout=60)
+                failed = not response.ok or 'errors' in response.json()
+            except (requests.RequestException, ValueError):
+                failed = True
+
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(index,))
+               for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - started_at
+    latencies.sort()
+
+    def percentile(share):
+        if not latencies:
+            return None
+        index = max(int(round(share * len(latencies))) - 1, 0)
+        return round(latencies[index] * 1000, 1)
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+    }
+
+
+def main():
+    args = arguments()
+    directory = tempfile.mkdtemp(prefix='loadtest-')
+
+    port = free_port()
+    url = (args.url or f'http://127.0.0.1:{port}').rstrip('/')
+
+    queue = Queue()
+    stub = Process(target=stubs, args=(args, directory, url, queue),
+                   daemon=True)
+    stub.start()
+    token, certificate = queue.get(timeout=30)
+
+    relay = None
+    if args.url:
+        print(f'The relay has to trust {certificate} '
+              f'(e.g. with REQUESTS_CA_BUNDLE).', file=sys.stderr)
+    else:
+        relay = subprocess.Popen(
+            [sys.executable, '-m', 'loadtest.relay', str(port), *args.set],
+            env={**os.environ, 'REQUESTS_CA_BUNDLE': certificate},
+        )
+        wait_for(port)
+
+    bodies = payloads(args)
+    results = {}
+
+    try:
+        for endpoint in args.endpoint or ENDPOINTS:
+            if args.warmup > 0:
+                drive(url + endpoint, token, bodies, args.concurrency,
+                      args.warmup)
+            results[endpoint] = drive(url + endpoint, token, bodies,
+                                      args.concurrency, args.duration)
+    finally:
+        if relay is not None:
+            relay.terminate()
+            relay.wait()
+        stub.terminate()
+
+    columns = ['requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms']
+    print(f'{"endpoint":<22}' + ''.join(f'{c:>10}' for c in columns))
+    for endpoint, result in results.items():
+        print(f'{endpoint:<22}'
+              + ''.join(f'{result[c]!s:>10}' for c in columns))
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
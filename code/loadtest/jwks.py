@@ -0,0 +1,106 @@
+"""A local JWKS issuer for signing the JWTs the relay is called with.
+
+The relay fetches the public keys over HTTPS only, so the keys are served
+with a self-signed certificate for 127.0.0.1. The relay has to trust it,
+e.g. through the `REQUESTS_CA_BUNDLE` environment variable.
+"""
+
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from jwt.algorithms import RSAAlgorithm
+
+KID = 'loadtest'
+
+
+class Issuer:
+    def __init__(self, directory: str):
+        self.key = rsa.generate_private_key(
+            public_exponent=65537, key_size=2048, backend=default_backend()
+        )
+        self.certificate = os.path.join(directory, 'jwks.pem')
+        self.private_key = os.path.join(directory, 'jwks.key')
+
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'loadtest')])
+        now = datetime.datetime.utcnow()
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(self.key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName(
+                [x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]
+            ), critical=False)
+            .add_extension(x509.BasicConstraints(ca=True, path_length=None),
+                           critical=True)
+            .sign(self.key, hashes.SHA256(), default_backend())
+        )
+
+        with open(self.certificate, 'wb') as file:
+            file.write(certificate.public_bytes(serialization.Encoding.PEM))
+        with open(self.private_key, 'wb') as file:
+            file.write(self.key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.TraditionalOpenSSL,
+                serialization.NoEncryption()
+            ))
+
+        self.server = None
+
+    @property
+    def host(self) -> str:
+        return f'127.0.0.1:{self.server.server_port}'
+
+    def jwks(self) -> Dict[str, Any]:
+        key = json.loads(RSAAlgorithm.to_jwk(self.key.public_key()))
+        return {'keys': [{**key, 'kid': KID, 'alg': 'RS256', 'use': 'sig'}]}
+
+    def token(self, payload: Dict[str, Any]) -> str:
+        """Signs a JWT with the `jwks_host` of the issuer."""
+        return jwt.encode({**payload, 'jwks_host': self.host}, self.key,
+                          algorithm='RS256', headers={'kid': KID})
+
+    def serve(self, port: int = 0):
+        """Starts serving the keys in a background thread."""
+
+        body = json.dumps(self.jwks()).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status = (HTTPStatus.OK
+                          if self.path == '/.well-known/jwks'
+                          else HTTPStatus.NOT_FOUND)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.certificate, self.private_key)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.server.socket = context.wrap_socket(self.server.socket,
+                                                 server_side=True)
+        threading.Thread(target=self.server.serve_forever,
+                         daemon=True).start()
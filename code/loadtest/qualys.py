@@ -0,0 +1,151 @@
+"""A fake Qualys IOC API serving `/auth` and `/ioc/events`.
+
+Every term of a search filter is found in a fixed number of synthetic
+events, so batched searches can be told apart like real ones. Latency,
+the largest page served and the share of throttled or failed responses
+are configurable.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from hashlib import sha256
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.corpus import event
+
+# Where the value of a filter field is put in an event.
+FIELDS = {
+    'file.hash.md5': ('file', 'md5'),
+    'file.hash.sha256': ('file', 'sha256'),
+    'file.name': ('file', 'fileName'),
+    'file.fullPath': ('file', 'fullPath'),
+    'network.local.address.ip': ('network', 'localIP'),
+    'network.remote.address.ip': ('network', 'remoteIP'),
+    'network.remote.address.fqdn': ('network', 'remoteDns'),
+    'handle.name': ('handle', 'name'),
+}
+
+TERM = re.compile(r'([\w.]+): "([^"]*)"')
+
+
+class Settings:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02,
+                 max_page_size: int = 100, events: int = 10,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.max_page_size = max_page_size
+        self.events = events
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+
+def found(filter_: str, count: int) -> List[Dict[str, Any]]:
+    """Returns the events found by a filter, the latest first."""
+
+    result = {}
+
+    for field, value in TERM.findall(filter_):
+        path = FIELDS.get(field)
+        if path is None:
+            continue
+
+        # Seeded by the field too, so a value matched by several fields,
+        # e.g. the local and the remote IP, is found in events of each.
+        seed = int(sha256(f'{field}:{value}'.encode()).hexdigest()[:12], 16)
+        for index in range(count):
+            event_ = event(seed + index, rng=random.Random(seed + index))
+
+            section, key = path
+            event_.setdefault(section, {})[key] = value
+            event_['state'] = index % 3 != 0
+
+            result.setdefault(event_['id'], event_)
+
+    return sorted(result.values(), key=lambda e: e['dateTime'], reverse=True)
+
+
+def handler(settings: Settings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status, body=b'', headers=()):
+            self.send_response(status)
+            for name, value in headers:
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def delay(self) -> bool:
+            """Waits for the latency and tells whether to fail the call."""
+
+            with settings.lock:
+                settings.requests += 1
+                latency = max(settings.latency + settings.rng.uniform(
+                    -settings.jitter, settings.jitter), 0)
+                fail = settings.rng.random() < settings.error_rate
+
+            time.sleep(latency)
+
+            if fail:
+                status = settings.rng.choice([
+                    HTTPStatus.TOO_MANY_REQUESTS,
+                    HTTPStatus.SERVICE_UNAVAILABLE,
+                ])
+                self.reply(status, headers=[('Retry-After', '1')])
+
+            return fail
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            if urlparse(self.path).path.endswith('/auth'):
+                if not self.delay():
+                    self.reply(HTTPStatus.CREATED, b'fake-qualys-token')
+            else:
+                self.reply(HTTPStatus.NOT_FOUND)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.endswith('/ioc/events'):
+                self.reply(HTTPStatus.NOT_FOUND)
+                return
+
+            if self.delay():
+                return
+
+            query = parse_qs(url.query)
+            size = min(int(query['pageSize'][0]), settings.max_page_size)
+            page = int(query.get('pageNumber', ['0'])[0])
+
+            events = found(query.get('filter', [''])[0], settings.events)
+            if query.get('state') == ['true']:
+                events = [e for e in events if e['state']]
+
+            body = json.dumps(events[page * size:(page + 1) * size]).encode()
+            self.reply(HTTPStatus.OK, body,
+                       [('Content-Type', 'application/json')])
+
+    return Handler
+
+
+def serve(settings: Settings, port: int = 0) -> ThreadingHTTPServer:
+    """Starts serving in a background thread."""
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
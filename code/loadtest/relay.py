@@ -0,0 +1,30 @@
+"""Serves the relay with a threaded development server for load tests.
+
+Run from the `code` folder as `python -m loadtest.relay PORT [KEY=VALUE]...`,
+where each `KEY=VALUE` overrides a setting with a JSON value.
+"""
+
+import json
+import sys
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import app
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def main(port: int, *settings: str):
+    for setting in settings:
+        key, _, value = setting.partition('=')
+        app.config[key] = json.loads(value)
+
+    make_server('127.0.0.1', port, app, threaded=True,
+                request_handler=QuietHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]), *sys.argv[2:])
@@ -0,0 +1,9 @@
+from pytest import fixture
+
+from app import app
+
+
+@fixture
+def app_context():
+    with app.app_context():
+        yield app
@@ -0,0 +1,57 @@
+from api import batches
+from api.events import Event
+from api.observables import IP, Domain
+
+
+def test_search_routes_ip_by_local_and_remote_address(app_context,
+                                                      monkeypatch):
+    events = [
+        Event('e1', localIP='10.0.0.5', remoteIP='8.8.8.8'),
+        Event('e2', localIP='192.0.2.1', remoteIP='10.0.0.5'),
+    ]
+    monkeypatch.setattr(batches.client, 'search',
+                        lambda *args: events)
+
+    found = batches.search(IP(), ['10.0.0.5', '8.8.8.8'], False, 10, {})
+
+    assert found == {'10.0.0.5': events, '8.8.8.8': events[:1]}
+
+
+def test_search_matches_values_case_insensitively(app_context, monkeypatch):
+    events = [Event('e1', remoteDns='Example.COM')]
+    monkeypatch.setattr(batches.client, 'search',
+                        lambda *args: events)
+
+    found = batches.search(Domain(), ['example.com', 'cisco.com'],
+                           False, 10, {})
+
+    assert found == {'example.com': events, 'cisco.com': []}
+
+
+def test_search_gives_up_on_events_it_cannot_route(app_context,
+                                                   monkeypatch):
+    events = [Event('e1', remoteIP='192.0.2.1')]
+    monkeypatch.setattr(batches.client, 'search',
+                        lambda *args: events)
+
+    assert batches.search(IP(), ['10.0.0.5', '8.8.8.8'],
+                          False, 10, {}) is None
+
+
+def test_search_stops_once_every_observable_is_full(app_context,
+                                                    monkeypatch):
+    monkeypatch.setitem(app_context.config, 'QUALYS_PAGE_SIZE', 2)
+    pages = []
+
+    def search(active, amount, creds, filter_, page):
+        pages.append(page)
+        return [Event(f'e{page}', localIP='10.0.0.5', remoteIP='8.8.8.8'),
+                Event(f'f{page}', remoteIP='8.8.8.8')]
+
+    monkeypatch.setattr(batches.client, 'search', search)
+
+    found = batches.search(IP(), ['10.0.0.5', '8.8.8.8'], False, 2, {})
+
+    assert pages == [0, 1]
+    assert [event.id for event in found['10.0.0.5']] == ['e0', 'e1']
+    assert [event.id for event in found['8.8.8.8']] == ['e0', 'f0']
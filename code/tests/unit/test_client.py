@@ -0,0 +1,15 @@
+from api import client
+
+
+def test_token_keeps_only_the_most_recently_used_keys(app_context,
+                                                      monkeypatch):
+    monkeypatch.setitem(app_context.config, 'API_URL', 'https://qualys')
+    monkeypatch.setitem(app_context.config, 'QUALYS_TOKEN_CACHE_MAX_KEYS', 2)
+    monkeypatch.setattr(client, '_tokens', client.OrderedDict())
+    monkeypatch.setattr(client, 'fetch_token',
+                        lambda api, creds: (float('inf'), creds['user']))
+
+    for user in ['a', 'b', 'a', 'c']:
+        assert client.token({'user': user, 'pass': 'secret'}) == user
+
+    assert [user for _, user, _ in client._tokens] == ['a', 'c']
@@ -0,0 +1,17 @@
+import json
+
+from api import metrics
+
+
+def test_values_are_flushed_once_a_request_is_served(app_context,
+                                                     monkeypatch, tmp_path):
+    monkeypatch.setitem(app_context.config, 'METRICS_PATH', str(tmp_path))
+    monkeypatch.setitem(app_context.config, 'METRICS_FLUSH_INTERVAL', 3600)
+    monkeypatch.setattr(metrics, '_flushed_at', float('inf'))
+
+    with app_context.test_client() as client:
+        client.get('/version').close()
+
+    file, = tmp_path.glob('*.json')
+    names = [name for name, _, _ in json.loads(file.read_text())]
+    assert 'relay_request_duration_seconds' in names
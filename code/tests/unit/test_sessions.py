@@ -0,0 +1,15 @@
+from requests.exceptions import ConnectionError, ReadTimeout
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+from api.sessions import read_timed_out
+
+
+def test_read_timed_out_on_body_read_timeout():
+    error = ConnectionError(ReadTimeoutError(None, None, 'Read timed out.'))
+    assert read_timed_out(error)
+
+
+def test_read_timed_out_on_other_errors():
+    assert not read_timed_out(ConnectionError(ProtocolError('reset')))
+    assert not read_timed_out(ConnectionError())
+    assert not read_timed_out(ReadTimeout())
@@ -0,0 +1,73 @@
+import json
+
+from pytest import mark, raises
+
+from api.utils import iter_json_array
+
+BODY = '[{"id": "é1", "score": 12345}, -1.5e3, "日本", true, null, []]'
+
+
+def split(body: bytes, size: int):
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+@mark.parametrize('size', range(1, len(BODY.encode()) + 1))
+def test_iter_json_array_parses_any_chunks(size):
+    chunks = split(BODY.encode(), size)
+    assert list(iter_json_array(chunks)) == json.loads(BODY)
+
+
+def test_iter_json_array_joins_a_split_number():
+    assert list(iter_json_array([b'[12', b'34, 5', b'6]'])) == [1234, 56]
+    assert list(iter_json_array([b'[-1.', b'5e', b'3]'])) == [-1500.0]
+
+
+def test_iter_json_array_joins_a_split_utf8_sequence():
+    encoded = '["日"]'.encode()
+    chunks = [encoded[:3], encoded[3:]]
+
+    assert list(iter_json_array(chunks)) == ['日']
+
+
+def test_iter_json_array_accepts_whitespace():
+    assert list(iter_json_array([b' \n[ 1 ,\t2 ] \r\n'])) == [1, 2]
+    assert list(iter_json_array([b'[]'])) == []
+
+
+@mark.parametrize('body', [
+    b'',
+    b'{"id": 1}',
+    b'[1 2]',
+    b'[1,,2]',
+    b'[,1]',
+    b'[1,]',
+    b'[1]garbage',
+    b'[1][2]',
+])
+def test_iter_json_array_rejects_invalid_json(body):
+    with raises(json.JSONDecodeError):
+        list(iter_json_array(split(body, 2)))
+
+
+@mark.parametrize('body', [
+    b'[{"id": 1}, {"id"',
+    b'[1, 2',
+    b'[12',
+    b'[',
+])
+def test_iter_json_array_rejects_a_truncated_body(body):
+    with raises(json.JSONDecodeError):
+        list(iter_json_array(split(body, 3)))
+
+
+def test_iter_json_array_rejects_a_truncated_utf8_sequence():
+    with raises(ValueError):
+        list(iter_json_array(['["日"]'.encode()[:3]]))
+
+
+def test_iter_json_array_yields_items_before_reading_further():
+    def chunks():
+        yield b'[1, 2, '
+        raise AssertionError('read too far')
+
+    assert next(iter_json_array(chunks())) == 1